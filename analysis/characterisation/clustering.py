@@ -1,12 +1,15 @@
 import numpy as np
 import polars as pl
 from datetime import date
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
 from sklearn.metrics import adjusted_rand_score
 from dateutil.relativedelta import relativedelta
 from data_io.loader.data_loader import DataLoader
-from analysis.characterisation.features import build_feature_df
+from analysis.characterisation.features import WindowStats, build_feature_df
 from analysis.characterisation.helpers import wilson_ci
 
 
@@ -42,8 +45,19 @@ def kmeans_clustering(features, k):
     )
 
 
-def cluster_until_with_centroids(loader, k, interval, min_stations=5):
-    features = build_feature_df(loader, interval)
+def window_features(loader, interval, stats=None):
+    # stats: WindowStats of the loader, the features of a window of whole months are looked up from it
+    if stats is not None:
+        return stats.feature_df(interval)
+    return build_feature_df(loader, interval)
+
+
+def cluster_until_with_centroids(loader, k, interval, min_stations=5, stats=None):
+    features = window_features(loader, interval, stats=stats)
+    return cluster_features(features, k, min_stations=min_stations)
+
+
+def cluster_features(features, k, min_stations=5):
     features_valid = features.filter(pl.col("valid") == True)
 
     if features_valid.height < max(k, min_stations):
@@ -58,10 +72,56 @@ def cluster_until_with_centroids(loader, k, interval, min_stations=5):
     return df, centroids
 
 
+def label_window(feature_df, k, d, features):
+    """
+    Clusters the features of one window and labels the clusters by their utilitarian score,
+    returns the (station, date, usage_type) rows or None if there are too few valid stations.
+    """
+    out = cluster_features(feature_df, k)
+
+    if out is None:
+        return None
+
+    df, _ = out
+
+    cluster_means = compute_cluster_means(
+        df=df,
+        features=features
+    )
+    cluster_means = zscore_columns(df=cluster_means, features=features)
+    cluster_means = compute_utilitarian_score(df=cluster_means, features=features)
+
+    cluster_labels = label_clusters_by_score(df=cluster_means)
+
+    df_labeled = df.with_columns([
+        pl.col("cluster")
+          .map_elements(lambda c: cluster_labels.get(c))
+          .alias("usage_type"),
+        pl.lit(d).alias("date")
+    ])
+
+    return df_labeled.select(["station", "date", "usage_type"])
+
+
+def _label_window(job):
+    # one BLAS / OpenMP thread per window with and without workers (the windows are the parallelism),
+    # KMeans runs with the same configuration on both paths
+    with threadpool_limits(limits=1):
+        return label_window(*job)
 
-def cluster_timeseries_usage(loader, k, start, end, mode, window_months, features):
+
+def cluster_timeseries_usage(loader, k, start, end, mode, window_months, features, workers=1):
+    """
+    Usage type of every station in the monthly windows from start to end (see make_interval).
+    With workers > 1 the windows are clustered on a process pool: the features of all windows are
+    built here from the loaded data and only they are sent to the workers, the rows keep the order
+    of the windows and are the same as without workers.
+    """
     dates = monthly_dates(start=start, end=end)
-    rows = []
+    jobs = []
+
+    # every window starts and ends on the day of the month of start, whole months if that is the first
+    stats = WindowStats(loader) if date.fromisoformat(start).day == 1 else None
 
     for d in dates:
         interval = make_interval(
@@ -79,35 +139,17 @@ def cluster_timeseries_usage(loader, k, start, end, mode, window_months, feature
 
         print(f"Perform Clustering in Interval {start_month_interval} until {end_month_interval}")
 
+        jobs.append((window_features(loader, interval, stats=stats), k, d, features))
 
-        out = cluster_until_with_centroids(
-            loader=loader,
-            k=k,
-            interval=interval
-        )
-
-        if out is None:
-            continue
-
-        df, _ = out
-
-        cluster_means = compute_cluster_means(
-            df=df,
-            features=features
-        )
-        cluster_means = zscore_columns(df=cluster_means, features=features)
-        cluster_means = compute_utilitarian_score(df=cluster_means, features=features)
-
-        cluster_labels = label_clusters_by_score(df=cluster_means)
-
-        df_labeled = df.with_columns([
-            pl.col("cluster")
-              .map_elements(lambda c: cluster_labels.get(c))
-              .alias("usage_type"),
-            pl.lit(d).alias("date")
-        ])
+    if workers > 1 and len(jobs) > 1:
+        # spawn: forking a process that already runs polars / OpenMP threads can deadlock
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=get_context("spawn")) as pool:
+            # a few batches of windows per worker, the results of map keep the order of jobs
+            results = list(pool.map(_label_window, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+    else:
+        results = [_label_window(job) for job in jobs]
 
-        rows.append(df_labeled.select(["station", "date", "usage_type"]))
+    rows = [df for df in results if df is not None]
 
     return pl.concat(rows) if rows else pl.DataFrame()
 
@@ -1,22 +1,38 @@
-from analysis.characterisation.helpers import find_peak
-from analysis.characterisation.indices import hourly_index, monthly_index
+from analysis.characterisation.indices import DAY_TYPES, INDICES, index_table, station_frame
+from data_io.loader.intervals import IntervalSet
 import polars as pl
 import numpy as np
+from datetime import date
+
+# everything the features are computed from: hourly index per day type and monthly index
+FEATURE_INDICES = ("I_h", "I_m")
+
+# number of keys of an index and the key of the first column of its matrix
+KEY_RANGE = {"hour": (24, 0), "weekday": (7, 1), "month": (12, 1)}
+
+SUMMER = [6, 7, 8]
+WINTER = [11, 12, 1, 2]
 
 
 def build_feature_df(loader, interval=None, filter_dates=None, neg_dates=False):
-    rows = []
+    # the indices of all stations in one query, the features of all stations in one call of feature_arrays
+    stations = loader.get_bicyle_stations()
+    table = index_table(
+        loader, interval=interval, filter_dates=filter_dates, neg_dates=neg_dates, stations=stations, indices=FEATURE_INDICES
+    )
+    return feature_frame(stations, feature_arrays(*feature_matrices(table, stations)))
 
-    for station in loader.get_bicyle_stations():
-        feats = calc_feature_vector(
-            loader, station, interval, filter_dates=filter_dates, neg_dates=neg_dates
-        )
 
+def feature_frame(stations, feats):
+    # one row per station, stations with an undefined feature are not valid
+    rows = []
+
+    for i, station in enumerate(stations):
         row = {"station": station}
-        if feats is None:
+        if np.isnan([feats["DPI"][i], feats["WSD"][i], feats["SDI"][i]]).any():
             row["valid"] = False
         else:
-            row.update(feats)
+            row.update({name: float(values[i]) for name, values in feats.items()})
             row["valid"] = True
 
         rows.append(row)
@@ -27,96 +43,278 @@ def build_feature_df(loader, interval=None, filter_dates=None, neg_dates=False):
 def calc_feature_vector(
     loader, station_name, interval=None, filter_dates=None, neg_dates=False
 ):
-    Ih_weekday = hourly_index(
-        loader=loader,
-        station_name=station_name,
+    table = index_table(
+        loader,
         interval=interval,
-        weekday=True,
         filter_dates=filter_dates,
         neg_dates=neg_dates,
+        stations=[station_name],
+        indices=FEATURE_INDICES,
     )
-    Ih_weekend = hourly_index(
-        loader=loader,
-        station_name=station_name,
-        interval=interval,
-        weekday=False,
-        filter_dates=filter_dates,
-        neg_dates=neg_dates,
+    return feature_vector(table, station_name)
+
+
+def feature_vector(table, station_name):
+    """
+    DPI, WSD and SDI of one station from its rows of index_table, None if the station has no data in
+    summer or winter or a feature is undefined.
+    """
+    feats = feature_arrays(*feature_matrices(table, [station_name]))
+    if np.isnan([values[0] for values in feats.values()]).any():
+        return None
+    return {name: float(values[0]) for name, values in feats.items()}
+
+
+class WindowStats:
+    """
+    Sufficient statistics of the features per station and calendar month, stored as prefix sums over the months:
+    hourly sums / counts per day type and hour, daily sums / counts (mean daily count) and daily sums / counts
+    per month of the year. The features of any window of whole months (e.g. the sliding or cumulative windows of
+    make_interval) come from two lookups instead of a pass over the data.
+    filter_dates / neg_dates as in build_feature_df.
+    """
+
+    def __init__(self, loader, channel="channels_all", filter_dates=None, neg_dates=False):
+        self.stations = loader.get_bicyle_stations()
+        n = len(self.stations)
+
+        hourly = station_frame(loader, "1h", None, self.stations).collect()
+        daily = station_frame(loader, "1d", None, self.stations).collect()
+
+        # months are counted from january of the first year with data
+        first = min(frame["datetime"].min() for frame in (hourly, daily) if frame.height)
+        self.first_year = first.year
+        last = max(frame["datetime"].max() for frame in (hourly, daily) if frame.height)
+        self.n_months = (last.year - self.first_year) * 12 + last.month
+
+        month = (
+            (pl.col("datetime").dt.year().cast(pl.Int64) - self.first_year) * 12
+            + pl.col("datetime").dt.month().cast(pl.Int64) - 1
+        ).alias("m")
+        value = pl.col(channel).cast(pl.Float64)
+
+        # mean daily count: over all days, like index_table
+        totals = daily.group_by("station", month).agg(
+            pl.col("channels_all").cast(pl.Float64).sum().alias("sum"), pl.col("channels_all").count().alias("count")
+        )
+
+        if filter_dates:
+            intervals = filter_dates if isinstance(filter_dates, IntervalSet) else IntervalSet(filter_dates)
+            keep = intervals.contains_expr("datetime")
+            hourly = hourly.filter(~keep if neg_dates else keep)
+            daily = daily.filter(~keep if neg_dates else keep)
+
+        hours = hourly.group_by(
+            "station",
+            month,
+            # the split of BaseData.filter_time(weekday=...), 0 = weekday, 1 = weekend
+            (pl.col("datetime").dt.weekday() >= 5).cast(pl.Int64).alias("weekend"),
+            pl.col("datetime").dt.hour().cast(pl.Int64).alias("hour"),
+        ).agg(value.sum().alias("sum"), value.count().alias("count"))
+
+        days = daily.group_by("station", month).agg(value.sum().alias("sum"), value.count().alias("count"))
+
+        shape = (n, self.n_months)
+        self.hour_sum = self._prefix(hours, shape + (2, 24), ["weekend", "hour"], "sum")
+        self.hour_count = self._prefix(hours, shape + (2, 24), ["weekend", "hour"], "count")
+        self.day_sum = self._prefix(totals, shape, [], "sum")
+        self.day_count = self._prefix(totals, shape, [], "count")
+
+        # per month of the year, every calendar month only adds to its own column
+        days = days.with_columns((pl.col("m") % 12).alias("moy"))
+        self.month_sum = self._prefix(days, shape + (12,), ["moy"], "sum")
+        self.month_count = self._prefix(days, shape + (12,), ["moy"], "count")
+
+    @staticmethod
+    def _prefix(df, shape, keys, column):
+        values = np.zeros(shape)
+        index = tuple(df[c].to_numpy().astype(np.int64) for c in ["station", "m", *keys])
+        values[index] = df[column].to_numpy()
+
+        # prefix[:, b] - prefix[:, a] is the sum over the months a..b-1
+        prefix = np.zeros((shape[0], shape[1] + 1) + shape[2:])
+        np.cumsum(values, axis=1, out=prefix[:, 1:])
+        return prefix
+
+    def month_index(self, day):
+        """
+        Position of the first day of a month in the prefix sums (clipped to the data)
+        """
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        if day.day != 1:
+            raise ValueError(f"{day} is not the first day of a month")
+        return min(max((day.year - self.first_year) * 12 + day.month - 1, 0), self.n_months)
+
+    def matrices(self, interval=None):
+        """
+        Same as feature_matrices(index_table(loader, interval=interval, ...), stations) for an interval of whole months
+        """
+        a, b = (0, self.n_months) if interval is None else (self.month_index(interval[0]), self.month_index(interval[1]))
+        b = max(a, b)
+
+        def window(prefix):
+            return prefix[:, b] - prefix[:, a]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_C_24h = window(self.day_sum) / window(self.day_count)
+
+            count = window(self.hour_count)
+            Ih = np.where(count > 0, window(self.hour_sum) / count, np.nan) / mean_C_24h[:, None, None]
+
+            count = window(self.month_count)
+            Im = np.where(count > 0, window(self.month_sum) / count, np.nan) / mean_C_24h[:, None]
+
+        return Ih[:, 0], Ih[:, 1], Im
+
+    def feature_df(self, interval=None):
+        """
+        Same as build_feature_df(loader, interval) for an interval of whole months
+        """
+        return feature_frame(self.stations, feature_arrays(*self.matrices(interval)))
+
+
+def index_matrix(table, stations, index, weekday=None):
+    """
+    (len(stations) x keys) matrix of the values of one index and day type of index_table
+    (weekday as in hourly_index), NaN where a station has no value for a key.
+    """
+    _, key, _ = INDICES[index]
+    size, first = KEY_RANGE[key]
+    matrix = np.full((len(stations), size), np.nan)
+
+    rows = (
+        table
+        .filter((pl.col("index") == index) & (pl.col("day_type") == DAY_TYPES[weekday]))
+        .join(pl.DataFrame({"station": list(stations), "row": np.arange(len(stations))}), on="station")
     )
-    Im = monthly_index(
-        loader=loader,
-        station_name=station_name,
-        interval=interval,
-        filter_dates=filter_dates,
-        neg_dates=neg_dates,
+    matrix[rows["row"].to_numpy(), rows["key"].to_numpy().astype(np.int64) - first] = rows["value"].to_numpy()
+    return matrix
+
+
+def feature_matrices(table, stations):
+    """
+    Weekday and weekend profile (n x 24) and monthly index (n x 12) of the stations, the inputs of feature_arrays
+    """
+    return (
+        index_matrix(table, stations, "I_h", weekday=True),
+        index_matrix(table, stations, "I_h", weekday=False),
+        index_matrix(table, stations, "I_m"),
     )
 
-    # seasons must be required, station which does not exist for given interval => height = 0
-    # we want to cluster all stations which do not exist for given interval with None
-    if (
-        Im.filter(pl.col("month").is_in([6, 7, 8])).height == 0
-        or Im.filter(pl.col("month").is_in([11, 12, 1, 2])).height == 0
-    ):
-        return None
 
-    dpi = double_peak_index(Ih=Ih_weekday)
-    wsd = weekend_shape_diff_index(Ih_wd=Ih_weekday, Ih_we=Ih_weekend)
-    sdi = seasonal_drop_index(Im=Im)
-    
-    if dpi is None or wsd is None or sdi is None:
-        return None
+def feature_arrays(Ih_wd, Ih_we, Im):
+    """
+    DPI, WSD and SDI of every row of the (n x 24) weekday / weekend profiles and (n x 12) monthly indices
+    (NaN for a missing key). NaN in the result where the feature is None: no data in summer or winter,
+    or the feature itself is undefined.
+    """
+    Ih_wd, Ih_we, Im = (np.atleast_2d(np.asarray(m, dtype=np.float64)) for m in (Ih_wd, Ih_we, Im))
 
-    return {"DPI": dpi, "WSD": wsd, "SDI": sdi}
+    # seasons must be required, station which does not exist for given interval => no months
+    # we want to cluster all stations which do not exist for given interval with None
+    seasons = (
+        ~np.isnan(Im[:, np.array(SUMMER) - 1]).all(axis=1)
+        & ~np.isnan(Im[:, np.array(WINTER) - 1]).all(axis=1)
+    )
+
+    feats = {
+        "DPI": double_peak_kernel(Ih_wd),
+        "WSD": weekend_shape_diff_kernel(Ih_wd, Ih_we),
+        "SDI": seasonal_drop_kernel(Im),
+    }
+    return {name: np.where(seasons, values, np.nan) for name, values in feats.items()}
 
 
 """ FEATURES """
 
 
-def seasonal_drop_index(Im):
-    q10 = Im["I_m"].quantile(0.1)
-    q90 = Im["I_m"].quantile(0.9)
+def _profile(df, key, column):
+    # one index frame (e.g. of hourly_index) as a 1 x keys matrix
+    size, first = KEY_RANGE[key]
+    matrix = np.full((1, size), np.nan)
+    values = df[column].cast(pl.Float64).fill_null(np.nan).to_numpy()
+    matrix[0, df[key].to_numpy().astype(np.int64) - first] = values
+    return matrix
 
-    if q90 is None or q90 <= 0:
-        return None
-    
-    return (q90 - q10) / q90
 
+def _scalar(values):
+    value = values[0]
+    return None if np.isnan(value) else float(value)
 
-def double_peak_index(Ih):
-    h_m, p_m = find_peak(Ih, 5, 10)  # first peak
-    h_e, p_e = find_peak(Ih, 14, 20)  # second peak
 
-    midday_df = Ih.filter((pl.col("hour") >= 8) & (pl.col("hour") < 14))
-    if midday_df.height == 0:
-        return None
-    
-    midday = midday_df.select(pl.mean("I_h")).item()
-    if midday is None:
-        return None
-    
-    strength = ((p_m - midday) + (p_e - midday)) / 2
-    strength = max(strength, 0)
+def _peak(Ih, hour_min, hour_max):
+    # hour and value of the maximum in [hour_min, hour_max) per row, the first hour wins ties
+    window = Ih[:, hour_min:hour_max]
+    found = ~np.isnan(window).all(axis=1)
+    window = np.where(np.isnan(window), -np.inf, window)
+    idx = window.argmax(axis=1)
+    return hour_min + idx, window[np.arange(len(window)), idx], found
 
-    symmetry = 1 - abs(p_m - p_e) / max(p_m, p_e)
 
-    distance = min(abs(h_e - h_m) / 10, 1.0)
-    
-    score = strength * symmetry * distance
-    return float(max(score, 0))
+def _nearest_quantile(values, q):
+    # per row over the non NaN values, like pl.Series.quantile(q) ("nearest")
+    n = (~np.isnan(values)).sum(axis=1)
+    ordered = np.sort(values, axis=1)  # NaN last
+    idx = np.floor(q * np.maximum(n - 1, 0) + 0.5).astype(np.int64)
+    result = ordered[np.arange(len(values)), idx]
+    return np.where(n > 0, result, np.nan)
 
 
-def weekend_shape_diff_index(Ih_wd, Ih_we):
-    if Ih_wd is None or Ih_we is None:
-        return None
-    
-    p_wd = Ih_wd["I_h"].to_numpy()
-    p_we = Ih_we["I_h"].to_numpy()
+def seasonal_drop_kernel(Im):
+    q10 = _nearest_quantile(Im, 0.1)
+    q90 = _nearest_quantile(Im, 0.9)
 
-    if len(p_wd) != 24 or len(p_we) != 24:
-        return None
-    
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drop = (q90 - q10) / q90
+    return np.where(q90 > 0, drop, np.nan)
+
+
+def double_peak_kernel(Ih):
+    h_m, p_m, found_m = _peak(Ih, 5, 10)  # first peak
+    h_e, p_e, found_e = _peak(Ih, 14, 20)  # second peak
 
-    p_wd = p_wd / p_wd.sum()
-    p_we = p_we / p_we.sum()
+    midday_hours = Ih[:, 8:14]
+    has_midday = ~np.isnan(midday_hours).all(axis=1)
 
-    return float(np.linalg.norm(p_wd - p_we))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        midday = np.nanmean(np.where(has_midday[:, None], midday_hours, 0.0), axis=1)
+
+        strength = ((p_m - midday) + (p_e - midday)) / 2
+        strength = np.maximum(strength, 0)
+
+        peak = np.maximum(p_m, p_e)
+        symmetry = 1 - np.abs(p_m - p_e) / peak
+
+        distance = np.minimum(np.abs(h_e - h_m) / 10, 1.0)
+
+        score = np.maximum(strength * symmetry * distance, 0)
+
+    valid = found_m & found_e & has_midday & (peak != 0)
+    return np.where(valid, score, np.nan)
+
+
+def weekend_shape_diff_kernel(Ih_wd, Ih_we):
+    # only complete profiles (all 24 hours)
+    complete = ~np.isnan(Ih_wd).any(axis=1) & ~np.isnan(Ih_we).any(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p_wd = Ih_wd / Ih_wd.sum(axis=1, keepdims=True)
+        p_we = Ih_we / Ih_we.sum(axis=1, keepdims=True)
+        diff = np.linalg.norm(p_wd - p_we, axis=1)
+
+    return np.where(complete, diff, np.nan)
+
+
+def seasonal_drop_index(Im):
+    return _scalar(seasonal_drop_kernel(_profile(Im, "month", "I_m")))
+
+
+def double_peak_index(Ih):
+    return _scalar(double_peak_kernel(_profile(Ih, "hour", "I_h")))
+
+
+def weekend_shape_diff_index(Ih_wd, Ih_we):
+    if Ih_wd is None or Ih_we is None:
+        return None
+    return _scalar(weekend_shape_diff_kernel(_profile(Ih_wd, "hour", "I_h"), _profile(Ih_we, "hour", "I_h")))
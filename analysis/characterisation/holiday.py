@@ -3,8 +3,6 @@ from datetime import date
 from analysis.characterisation.helpers import dominant_usage_per_station
 
 def holiday_count_df(loader, usage_probs):
-    rows = []
-
     intervals = loader.get_all_holiday_intervals(school_vacation=False)
 
     holiday_dates = []
@@ -24,15 +22,11 @@ def holiday_count_df(loader, usage_probs):
         .with_columns(pl.lit("H").alias("holiday_flag"))
     )
 
-    for station in loader.get_bicyle_stations():
-        df = loader.get_bicycle(station, sample_rate="1d").df
-        df = df.select(["datetime", "channels_all"]).with_columns(
-            pl.lit(station).alias("station"),
-            pl.col("datetime").dt.date().alias("date"),
-        )
-        rows.append(df)
-
-    df = pl.concat(rows)
+    df = loader.get_bicycle_all(sample_rate="1d", lazy=True).df
+    df = df.select(["datetime", "channels_all", "station"]).with_columns(
+        pl.col("station").cast(pl.String),
+        pl.col("datetime").dt.date().alias("date"),
+    )
 
     df = df.join(
         dominant_usage_per_station(usage_probs),
@@ -1,4 +1,16 @@
 import polars as pl
+from data_io.loader.intervals import IntervalSet
+
+# key column and mean column of every index, the means are divided by the mean daily count of the station
+INDICES = {
+    "I_h": ("1h", "hour", "mean_C_1h"),
+    "I_d": ("1d", "weekday", "mean_C_1d"),
+    "I_m": ("1d", "month", "mean_C_1d"),
+}
+
+# weekday argument of the per-station functions -> day_type in index_table
+DAY_TYPES = {True: "weekday", False: "weekend", None: "all"}
+
 
 def daily_mean_count(loader, station_name, interval=None):
     df = loader.get_bicycle(
@@ -10,66 +22,129 @@ def daily_mean_count(loader, station_name, interval=None):
     return df["channels_all"].item()
 
 
-def hourly_index(loader, station_name, channel="channels_all", interval=None, weekday=None, filter_dates=None, neg_dates=False):
-    df = loader.get_bicycle(
-        station_name, interval=interval, sample_rate="1h"
-    ).filter_time(weekday=weekday).filter_intervals(intervals=filter_dates, negate=neg_dates).df
-
-    mean_C_24h = daily_mean_count(loader, station_name, interval)
-
-    Ih = (
-        df
-        .with_columns([
-            pl.col("datetime").dt.hour().alias("hour"),
-        ])
-        .group_by("hour")
-        .agg(pl.mean(channel).alias("mean_C_1h"))
-        .with_columns((pl.col("mean_C_1h") / mean_C_24h).alias("I_h"))
-        .sort("hour")
+def station_frame(loader, sample_rate, interval, stations):
+    # the (memoized) frames of the stations, station is the position in stations (grouping by it is much
+    # cheaper than by the name), the loaded stations are not combined again
+    frames = [
+        loader.get_bicycle(station, interval=interval, sample_rate=sample_rate)
+        .df.with_columns(pl.lit(i, dtype=pl.UInt32).alias("station"))
+        for i, station in enumerate(stations)
+    ]
+    return pl.concat(frames, how="vertical_relaxed").lazy()
+
+
+def index_table(loader, channel="channels_all", interval=None, filter_dates=None, neg_dates=False, stations=None, indices=("I_h", "I_d", "I_m")):
+    """
+    Hourly (I_h), daily (I_d) and monthly (I_m) indices of all stations (or the given ones) in one tidy table
+    with the columns station, index, day_type ("weekday", "weekend" or "all"), key (hour, weekday or month),
+    mean (mean count per key) and value (mean / mean daily count of the station over the interval).
+    Every resolution is grouped once by station, day type and key, "all" is summed from weekday and weekend.
+    filter_dates / neg_dates select the days like BaseData.filter_intervals, the mean daily count is taken over
+    the whole interval.
+    """
+    if stations is None:
+        stations = loader.get_bicyle_stations()
+    if not stations:
+        return pl.DataFrame(schema={
+            "station": pl.String, "index": pl.String, "day_type": pl.String,
+            "key": pl.Int8, "mean": pl.Float64, "value": pl.Float64,
+        })
+
+    daily = station_frame(loader, "1d", interval, stations)
+
+    # mean of the daily counts per station (before filter_dates, like daily_mean_count)
+    mean_C_24h = daily.group_by("station").agg(pl.col("channels_all").mean().alias("mean_C_24h")).collect()
+
+    frames = {"1d": daily}
+    if any(INDICES[index][0] == "1h" for index in indices):
+        frames["1h"] = station_frame(loader, "1h", interval, stations)
+
+    if filter_dates:
+        # same as BaseData.filter_intervals
+        intervals = filter_dates if isinstance(filter_dates, IntervalSet) else IntervalSet(filter_dates)
+        keep = intervals.contains_expr("datetime")
+        frames = {rate: lf.filter(~keep if neg_dates else keep) for rate, lf in frames.items()}
+
+    tables = []
+    for index in indices:
+        rate, key, _ = INDICES[index]
+        dt = pl.col("datetime")
+        key_expr = {"hour": dt.dt.hour(), "weekday": dt.dt.weekday(), "month": dt.dt.month()}[key]
+
+        parts = (
+            frames[rate]
+            .group_by(
+                "station",
+                # the split of BaseData.filter_time(weekday=...)
+                pl.when(dt.dt.weekday() < 5).then(pl.lit("weekday")).otherwise(pl.lit("weekend")).alias("day_type"),
+                key_expr.alias("key"),
+            )
+            .agg(
+                pl.col(channel).cast(pl.Float64).sum().alias("sum"),
+                pl.col(channel).count().alias("count"),
+            )
+            .collect()
+        )
+        both = parts.group_by("station", "key").agg(
+            pl.lit("all").alias("day_type"),
+            pl.col("sum").sum(),
+            pl.col("count").sum(),
+        )
+
+        tables.append(
+            pl.concat([parts, both.select(parts.columns)])
+            .with_columns(pl.lit(index).alias("index"))
+        )
+
+    return (
+        pl.concat(tables)
+        .select(
+            "station",
+            "index",
+            "day_type",
+            "key",
+            pl.when(pl.col("count") > 0).then(pl.col("sum") / pl.col("count")).alias("mean"),
+        )
+        .join(mean_C_24h, on="station", how="left")
+        .with_columns((pl.col("mean") / pl.col("mean_C_24h")).alias("value"))
+        .drop("mean_C_24h")
+        .sort("station", "index", "day_type", "key")
+        .with_columns(pl.col("station").replace_strict(range(len(stations)), list(stations), return_dtype=pl.String))
     )
-    return Ih
 
 
-def daily_index(loader, station_name, channel="channels_all", interval=None, weekday=None, filter_dates=None, neg_dates=False):
-    df = loader.get_bicycle(
-        station_name,
-        interval=interval,
-        sample_rate="1d"
-    ).filter_time(weekday=weekday).filter_intervals(intervals=filter_dates, negate=neg_dates).df
-
-    mean_C_24h = daily_mean_count(loader, station_name, interval)
-
-    Id = (
-        df.with_columns([
-            pl.col("datetime").dt.weekday().alias("weekday"),
-        ])
-        .group_by("weekday")
-        .agg(pl.mean(channel).alias("mean_C_1d"))
-        .with_columns((pl.col("mean_C_1d") / mean_C_24h).alias("I_d"))
-        .sort("weekday")
+def index_view(table, station_name, index, weekday=None):
+    """
+    The rows of one station, index and day type (weekday as in hourly_index) of index_table,
+    shaped like the result of hourly_index / daily_index / monthly_index.
+    """
+    _, key, mean = INDICES[index]
+    return (
+        table
+        .filter(
+            (pl.col("station") == station_name)
+            & (pl.col("index") == index)
+            & (pl.col("day_type") == DAY_TYPES[weekday])
+        )
+        .select(
+            pl.col("key").alias(key),
+            pl.col("mean").alias(mean),
+            pl.col("value").alias(index),
+        )
+        .sort(key)
     )
-    return Id
 
 
+def hourly_index(loader, station_name, channel="channels_all", interval=None, weekday=None, filter_dates=None, neg_dates=False):
+    table = index_table(loader, channel, interval, filter_dates, neg_dates, stations=[station_name], indices=("I_h",))
+    return index_view(table, station_name, "I_h", weekday)
 
-def monthly_index(loader, station_name, channel="channels_all", interval=None, weekday=None, filter_dates=None, neg_dates=False):
-    df = loader.get_bicycle(
-            station_name,
-            interval=interval,
-            sample_rate="1d"
-        ).filter_time(weekday=weekday).filter_intervals(intervals=filter_dates, negate=neg_dates).df
-
-    mean_C_24h = daily_mean_count(loader, station_name, interval)
-
-    Im = (
-        df
-        .with_columns([
-            pl.col("datetime").dt.month().alias("month"),
-        ])
-        .group_by("month")
-        .agg(pl.mean(channel).alias("mean_C_1d"))
-        .with_columns((pl.col("mean_C_1d") / mean_C_24h).alias("I_m"))
-        .sort("month")
-    )
 
-    return Im
+def daily_index(loader, station_name, channel="channels_all", interval=None, weekday=None, filter_dates=None, neg_dates=False):
+    table = index_table(loader, channel, interval, filter_dates, neg_dates, stations=[station_name], indices=("I_d",))
+    return index_view(table, station_name, "I_d", weekday)
+
+
+def monthly_index(loader, station_name, channel="channels_all", interval=None, weekday=None, filter_dates=None, neg_dates=False):
+    table = index_table(loader, channel, interval, filter_dates, neg_dates, stations=[station_name], indices=("I_m",))
+    return index_view(table, station_name, "I_m", weekday)
@@ -9,6 +9,8 @@ from analysis.characterisation.indices import (
     hourly_index,
     daily_index,
     monthly_index,
+    index_table,
+    index_view,
 )
 from analysis.characterisation.plotting.plot_style import WE_COLOR, WD_COLOR, WARM_COLOR, COLD_COLOR
 
@@ -144,29 +146,24 @@ def plot_hourly_indices_all(
     Ih_wd_all = []
     Ih_we_all = []
 
+    # all stations in one query
+    table = index_table(
+        loader,
+        channel,
+        interval,
+        filter_dates=filter_dates,
+        neg_dates=neg_dates,
+        stations=stations,
+        indices=("I_h",),
+    )
+
     if stations is None:
         stations = loader.get_bicyle_stations()
 
 
     for station in stations:
-        Ih_wd = hourly_index(
-            loader,
-            station,
-            channel,
-            interval,
-            weekday=True,
-            filter_dates=filter_dates,
-            neg_dates=neg_dates,
-        )
-        Ih_we = hourly_index(
-            loader,
-            station,
-            channel,
-            interval,
-            weekday=False,
-            filter_dates=filter_dates,
-            neg_dates=neg_dates,
-        )
+        Ih_wd = index_view(table, station, "I_h", weekday=True)
+        Ih_we = index_view(table, station, "I_h", weekday=False)
 
         Ih_wd_all.append(Ih_wd)
         Ih_we_all.append(Ih_we)
@@ -400,18 +397,21 @@ def plot_daily_indices_all(
 
     Id_all = []
 
+    table = index_table(
+        loader,
+        channel,
+        interval,
+        filter_dates=filter_dates,
+        neg_dates=neg_dates,
+        stations=stations,
+        indices=("I_d",),
+    )
+
     if stations is None:
         stations = loader.get_bicyle_stations()
 
     for station in stations:
-        Id = daily_index(
-            loader,
-            station,
-            channel,
-            interval=interval,
-            filter_dates=filter_dates,
-            neg_dates=neg_dates,
-        ).sort("weekday")
+        Id = index_view(table, station, "I_d")
         Id_all.append(Id)
 
         x = Id["weekday"].to_numpy()
@@ -588,11 +588,13 @@ def plot_monthly_indices_all(
 
     Im_all = []
 
+    table = index_table(loader, channel, interval, stations=stations, indices=("I_m",))
+
     if stations is None:
         stations = loader.get_bicyle_stations()
     
     for station in stations:
-        Im = monthly_index(loader, station, channel, interval=interval).sort("month")
+        Im = index_view(table, station, "I_m")
         Im_all.append(Im)
 
         x = Im["month"].to_numpy()
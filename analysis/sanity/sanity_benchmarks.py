@@ -0,0 +1,117 @@
+import time
+import shutil
+import tempfile
+import polars as pl
+from data_io.loader.data_loader import DataLoader
+from data_io.loader.base import BaseData
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - start, out
+
+
+# the DataLoader only loads data on first access, touch everything to measure the full startup
+def _load_all(**kwargs):
+    dl = DataLoader(**kwargs)
+    dl.bicycle_data, dl.weather_data, dl.accident_data, dl.holidays_data
+    return dl
+
+
+# compare the DataLoader startup without cache, with an empty cache (cold) and a filled cache (warm)
+def bench_cache_startup(city="Stadt_Heidelberg", repeats=3):
+    cache_folder = tempfile.mkdtemp(prefix="datalit_cache_")
+    rows = []
+
+    try:
+        for _ in range(repeats):
+            t, _ = _timed(lambda: _load_all(city=city, use_cache=False))
+            rows.append({"mode": "csv", "seconds": t})
+
+        t, _ = _timed(lambda: _load_all(city=city, cache_folder=cache_folder))
+        rows.append({"mode": "cold", "seconds": t})
+
+        for _ in range(repeats):
+            t, _ = _timed(lambda: _load_all(city=city, cache_folder=cache_folder))
+            rows.append({"mode": "warm", "seconds": t})
+    finally:
+        shutil.rmtree(cache_folder, ignore_errors=True)
+
+    return (
+        pl.DataFrame(rows)
+        .group_by("mode", maintain_order=True)
+        .agg(pl.col("seconds").min().alias("best_s"), pl.col("seconds").mean().alias("mean_s"))
+    )
+
+
+# interval() on the sorted station frames (binary search + slice) vs. the former full scan filter,
+# for the monthly windows of cluster_timeseries_usage
+def bench_interval_slicing(loader, start="2016-01-01", end="2025-01-01", mode="sliding", window_months=24):
+    from analysis.characterisation.clustering import make_interval, monthly_dates
+
+    intervals = [
+        make_interval(start=start, end=d, mode=mode, window_months=window_months)
+        for d in monthly_dates(start=start, end=end)
+    ]
+    intervals = [iv for iv in intervals if iv is not None]
+
+    frames = [loader.get_bicycle(station).df for station in loader.get_bicyle_stations()]
+    t_scan = t_slice = 0.0
+    n_rows = 0
+
+    for iv in intervals:
+        start_dt, end_dt = BaseData._bounds(iv[0], iv[1])
+
+        for df in frames:
+            t, scanned = _timed(lambda: df.filter(
+                (pl.col("datetime") >= start_dt) & (pl.col("datetime") < end_dt)
+            ))
+            t_scan += t
+
+            t, sliced = _timed(lambda: BaseData._interval_frame(df, start_dt, end_dt))
+            t_slice += t
+
+            assert scanned.height == sliced.height
+            n_rows += sliced.height
+
+    return pl.DataFrame({
+        "windows": [len(intervals)],
+        "stations": [len(frames)],
+        "rows_selected": [n_rows],
+        "scan_s": [t_scan],
+        "slice_s": [t_slice],
+        "speedup": [t_scan / t_slice if t_slice > 0 else None],
+    })
+
+
+# features of the monthly windows of cluster_timeseries_usage: build_feature_df per window vs. the prefix sums of WindowStats
+def bench_window_features(loader, start="2016-01-01", end="2025-01-01", mode="sliding", window_months=24):
+    from analysis.characterisation.clustering import make_interval, monthly_dates
+    from analysis.characterisation.features import WindowStats, build_feature_df
+
+    intervals = [
+        make_interval(start=start, end=d, mode=mode, window_months=window_months)
+        for d in monthly_dates(start=start, end=end)
+    ]
+    intervals = [iv for iv in intervals if iv is not None]
+
+    t_build, stats = _timed(lambda: WindowStats(loader))
+    t_direct = t_lookup = 0.0
+
+    for iv in intervals:
+        t, direct = _timed(lambda: build_feature_df(loader, iv))
+        t_direct += t
+
+        t, looked_up = _timed(lambda: stats.feature_df(iv))
+        t_lookup += t
+
+        assert direct["valid"].to_list() == looked_up["valid"].to_list()
+
+    return pl.DataFrame({
+        "windows": [len(intervals)],
+        "direct_s": [t_direct],
+        "stats_build_s": [t_build],
+        "lookup_s": [t_lookup],
+        "speedup": [t_direct / (t_build + t_lookup) if t_build + t_lookup > 0 else None],
+    })
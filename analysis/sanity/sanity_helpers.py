@@ -3,32 +3,26 @@ import polars as pl
 # get the absolute and relative failure rate with start and end date 
 # (to validate the output with Martin's Schaubild)
 def station_outage_rate(dl):
-    rows = []
+    df = dl.get_bicycle_all(sample_rate="1h", lazy=True).df
 
-    for station in dl.get_bicyle_stations():
-        bd = dl.get_bicycle(station_name=station, sample_rate="1h")
-        df = bd.df
-
-        if df.is_empty():
-            continue
-        
-        dt = (df.select(pl.col("datetime")).unique().sort("datetime"))        
-        start = bd.min_date()
-        end = bd.max_date()
-        
-
-        expected = pl.datetime_range(start=start, end=end, interval="1h", eager=True)
-        
-        missing_hours = (pl.DataFrame({"datetime": expected}).join(dt, on="datetime", how="anti").height)
-        
-        total_expected = len(expected)
-        rows.append({
-            "station": station,
-            "start": start.year,
-            "end": end.year,
-            "expected_hours": total_expected,
-            "missing_hours": missing_hours,
-            "outage_rate": missing_hours / total_expected,
-        })
-
-    return pl.DataFrame(rows).sort("outage_rate", descending=True)
\ No newline at end of file
+    # hourly buckets => every hour between the first and the last one is expected
+    return (
+        df.group_by("station")
+        .agg(
+            pl.col("datetime").min().alias("start"),
+            pl.col("datetime").max().alias("end"),
+            pl.col("datetime").n_unique().alias("present_hours"),
+        )
+        .with_columns(
+            ((pl.col("end") - pl.col("start")).dt.total_hours() + 1).alias("expected_hours"),
+        )
+        .select(
+            pl.col("station").cast(pl.String),
+            pl.col("start").dt.year().alias("start"),
+            pl.col("end").dt.year().alias("end"),
+            pl.col("expected_hours"),
+            (pl.col("expected_hours") - pl.col("present_hours")).alias("missing_hours"),
+            ((pl.col("expected_hours") - pl.col("present_hours")) / pl.col("expected_hours")).alias("outage_rate"),
+        )
+        .sort("outage_rate", descending=True)
+    )
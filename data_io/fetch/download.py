@@ -0,0 +1,495 @@
+# shared download helpers for the fetch scripts
+import io
+import os
+import json
+import hashlib
+import gzip
+import time
+import threading
+import contextlib
+import requests
+import urllib3
+import polars as pl
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# status codes worth another try, everything else (e.g. 404 for a month without data) fails immediately
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# the raw data archive (--archive of the fetch scripts): typed but otherwise untransformed source data,
+# one Parquet file per downloaded file
+ARCHIVE_OPTIONS = {"compression": "zstd", "compression_level": 10}
+
+
+def _session(local):
+    # requests.Session is not thread safe, every worker thread keeps its own (and its own connection pool)
+    if not hasattr(local, "session"):
+        local.session = requests.Session()
+    return local.session
+
+
+def remote_version(response):
+    """
+    ETag, Last-Modified and Content-Length of a response, used to tell whether a remote file changed.
+    """
+    size = response.headers.get("Content-Length")
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "size": int(size) if size is not None else None,
+    }
+
+
+def is_unchanged(entry, remote):
+    """
+    True if the remote file still matches the manifest entry: the ETag if the server sends one,
+    otherwise Last-Modified and size.
+    """
+    if entry is None:
+        return False
+    if remote.get("etag") is not None and entry.get("etag") is not None:
+        return remote["etag"] == entry["etag"] and remote.get("size") == entry.get("size")
+    if remote.get("last_modified") is None:
+        return False
+    return remote["last_modified"] == entry.get("last_modified") and remote.get("size") == entry.get("size")
+
+
+def head_file(url, session=None, retries=3, backoff=1.0, timeout=30):
+    """
+    HEAD request for url, retried like download_file.
+    Returns a dict with url, status, attempts, error and the remote_version fields.
+    """
+    session = session or requests
+    result = {"url": url, "status": None, "attempts": 0, "error": None}
+
+    for attempt in range(1, retries + 2):
+        result["attempts"] = attempt
+        try:
+            response = session.head(url, timeout=timeout, allow_redirects=True)
+            result["status"] = response.status_code
+
+            if response.status_code == 200:
+                result.update(remote_version(response))
+                result["error"] = None
+                break
+
+            result["error"] = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUS:
+                break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        if attempt <= retries:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+    return result
+
+
+def fetch_file(url, handle, session=None, retries=3, backoff=1.0, timeout=60):
+    """
+    GET url (streamed) and pass the response to handle(response), which returns the number of bytes it consumed.
+    Connection errors and RETRY_STATUS responses are retried with exponential backoff, handle is then called
+    again from the start.
+    Returns a dict with url, status, bytes, attempts, seconds, error (None on success) and the remote_version fields.
+    """
+    session = session or requests
+    result = {"url": url, "status": None, "bytes": 0, "attempts": 0, "seconds": 0.0, "error": None}
+    start = time.perf_counter()
+
+    for attempt in range(1, retries + 2):
+        result["attempts"] = attempt
+        try:
+            with session.get(url, stream=True, timeout=timeout) as response:
+                result["status"] = response.status_code
+
+                if response.status_code == 200:
+                    result.update(remote_version(response))
+                    result["bytes"] = handle(response)
+                    result["error"] = None
+                    break
+
+                result["error"] = f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUS:
+                    break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            urllib3.exceptions.HTTPError,
+        ) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        if attempt <= retries:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def download_file(url, path, session=None, retries=3, backoff=1.0, timeout=60, chunk_size=1 << 16):
+    """
+    Downloads url to path with fetch_file.
+    The file is written to path + ".part" first and only renamed once it is complete.
+    """
+    tmp_path = path + ".part"
+
+    def write(response):
+        size = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+        return size
+
+    result = fetch_file(url, write, session=session, retries=retries, backoff=backoff, timeout=timeout)
+    result["path"] = path
+
+    if result["error"] is not None and os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return result
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _validator(version):
+    # If-Range needs a strong ETag, Last-Modified otherwise
+    etag = version.get("etag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return version.get("last_modified")
+
+
+def _content_range(response):
+    # "bytes 100-199/1000" -> (100, 1000), the total may be unknown ("*")
+    value = response.headers.get("Content-Range", "")
+    try:
+        unit, spec = value.split(" ", 1)
+        span, total = spec.split("/", 1)
+        return int(span.split("-", 1)[0]), int(total) if total != "*" else None
+    except ValueError:
+        return None, None
+
+
+def _load_part(meta_path):
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _discard_part(tmp_path, meta_path):
+    for p in (tmp_path, meta_path):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def resume_download(url, path, session=None, retries=3, backoff=1.0, timeout=60, chunk_size=1 << 16, expected=None):
+    """
+    Downloads url to path like download_file, but an interrupted download is kept in path + ".part" and
+    continued with a Range request (by the next attempt or the next run). The part is only continued if
+    the remote file did not change in between (If-Range with the ETag / Last-Modified stored in
+    path + ".part.json"), otherwise the server sends the whole file and the download starts over.
+    The complete file must have the size announced by the server. expected ({"size", "sha256", "etag",
+    "last_modified"} of an earlier download) is checked as well if the remote file is still the same version,
+    a mismatch discards the file.
+    Returns the download_file fields plus "sha256" and "resumed" (bytes taken over from the part).
+    """
+    session = session or requests
+    tmp_path = path + ".part"
+    meta_path = tmp_path + ".json"
+    result = {"url": url, "path": path, "status": None, "bytes": 0, "attempts": 0, "seconds": 0.0,
+              "error": None, "sha256": None, "resumed": 0}
+    start = time.perf_counter()
+
+    for attempt in range(1, retries + 2):
+        result["attempts"] = attempt
+
+        part = _load_part(meta_path)
+        offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+        headers = {}
+        if offset and part is not None and part.get("url") == url and _validator(part) is not None:
+            headers = {"Range": f"bytes={offset}-", "If-Range": _validator(part)}
+        else:
+            _discard_part(tmp_path, meta_path)
+            offset = 0
+
+        try:
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                result["status"] = response.status_code
+
+                if response.status_code == 416:
+                    # the part does not fit the remote file (anymore)
+                    _discard_part(tmp_path, meta_path)
+                    result["error"] = "HTTP 416"
+                    continue
+
+                if response.status_code not in (200, 206):
+                    result["error"] = f"HTTP {response.status_code}"
+                    if response.status_code not in RETRY_STATUS:
+                        break
+                else:
+                    version = remote_version(response)
+                    if response.status_code == 206:
+                        first, version["size"] = _content_range(response)
+                        if first != offset:
+                            _discard_part(tmp_path, meta_path)
+                            result["error"] = f"unexpected Content-Range {response.headers.get('Content-Range')}"
+                            continue
+                        version.update({k: part[k] for k in ("etag", "last_modified") if version[k] is None})
+                    else:
+                        # full body: the server ignored the range or the remote file changed
+                        offset = 0
+                    result.update(version)
+                    result["resumed"] = offset
+
+                    with open(meta_path, "w") as f:
+                        json.dump({"url": url, **version}, f)
+
+                    with open(tmp_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            result["bytes"] += len(chunk)
+
+                    size = os.path.getsize(tmp_path)
+                    if version["size"] is not None and size != version["size"]:
+                        # connection closed early, the next attempt continues the part
+                        result["error"] = f"incomplete download ({size} of {version['size']} bytes)"
+                    else:
+                        result["sha256"] = sha256_file(tmp_path)
+                        result["error"] = check_expected(expected, version, size, result["sha256"])
+                        if result["error"] is None:
+                            os.replace(tmp_path, path)
+                            os.remove(meta_path)
+                            result["size"] = size
+                            break
+                        _discard_part(tmp_path, meta_path)
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            urllib3.exceptions.HTTPError,
+        ) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        if attempt <= retries:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def check_expected(expected, version, size, sha256):
+    """
+    Compares a downloaded file with the record of an earlier download of the same remote version.
+    Returns an error message or None.
+    """
+    if not expected:
+        return None
+    same = (
+        (version.get("etag") is not None and version.get("etag") == expected.get("etag"))
+        or (version.get("etag") is None and version.get("last_modified") is not None
+            and version.get("last_modified") == expected.get("last_modified"))
+    )
+    if not same:
+        # a new remote version, the record does not apply
+        return None
+    if expected.get("size") is not None and size != expected["size"]:
+        return f"size mismatch ({size} instead of {expected['size']} bytes)"
+    if expected.get("sha256") is not None and sha256 != expected["sha256"]:
+        return "checksum mismatch"
+    return None
+
+
+class _Tee(io.RawIOBase):
+    # read-only stream over the raw (still compressed) response body, optionally copied to a file
+    def __init__(self, raw, copy=None):
+        self.raw = raw
+        self.copy = copy
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer), decode_content=False)
+        n = len(data)
+        buffer[:n] = data
+        if self.copy is not None:
+            self.copy.write(data)
+        return n
+
+
+def iter_csv_gz(response, raw_path=None, batch_size=16 << 20, **read_csv_kwargs):
+    """
+    Decompresses a gzipped csv response while it is received and yields it as DataFrames
+    of about batch_size uncompressed bytes, so only one batch is held in memory at a time.
+    The batches are cut at line breaks, quoted fields must not contain line breaks.
+    With raw_path the compressed bytes are stored there as well.
+    """
+    tmp_path = raw_path + ".part" if raw_path is not None else None
+
+    try:
+        with contextlib.ExitStack() as stack:
+            copy = stack.enter_context(open(tmp_path, "wb")) if tmp_path is not None else None
+            gz = stack.enter_context(
+                gzip.GzipFile(fileobj=io.BufferedReader(_Tee(response.raw, copy), 1 << 20))
+            )
+
+            header = gz.readline()
+            rest = b""
+            while True:
+                block = gz.read(batch_size)
+                if not block:
+                    break
+
+                block = rest + block
+                cut = block.rfind(b"\n") + 1
+                rest = block[cut:]
+                if cut > 0:
+                    yield pl.read_csv(io.BytesIO(header + block[:cut]), **read_csv_kwargs)
+
+            if rest.strip():
+                yield pl.read_csv(io.BytesIO(header + rest), **read_csv_kwargs)
+    except BaseException:
+        # incomplete archive (connection lost, consumer stopped early)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if tmp_path is not None:
+        os.replace(tmp_path, raw_path)
+
+
+def write_archive(lf, path, metadata=None):
+    """
+    Writes lf to path as zstd compressed Parquet (to path + ".tmp" first), metadata (e.g. the remote version
+    of the source file) is stored in the file as strings.
+    """
+    tmp_path = path + ".tmp"
+    metadata = {k: str(v) for k, v in (metadata or {}).items() if v is not None}
+    try:
+        lf.sink_parquet(tmp_path, metadata=metadata, **ARCHIVE_OPTIONS)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def archive_metadata(path):
+    # the metadata passed to write_archive
+    return {k: v for k, v in pl.read_parquet_metadata(path).items() if not k.startswith("ARROW:")}
+
+
+def cache_key(url, params=None):
+    """
+    Hash of the url and the full request parameters (order independent).
+    """
+    text = json.dumps({"url": url, "params": params or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_json(url, params=None, cache_folder=None, session=None, retries=3, backoff=1.0, timeout=30):
+    """
+    GET url with params and return the decoded JSON body, retried like fetch_file.
+    With cache_folder the body is stored on disk under cache_key(url, params) and later calls with the
+    same url and parameters are answered from there without a request.
+    Raises requests.HTTPError if the request failed.
+    """
+    path = None
+    if cache_folder is not None:
+        path = os.path.join(cache_folder, cache_key(url, params) + ".json")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return json.loads(f.read())
+
+    body = []
+
+    def read(response):
+        body[:] = [response.content]
+        return len(body[0])
+
+    request_url = requests.Request("GET", url, params=params).prepare().url
+    result = fetch_file(request_url, read, session=session, retries=retries, backoff=backoff, timeout=timeout)
+    if result["error"] is not None:
+        raise requests.HTTPError(f"{result['error']} for {request_url}")
+
+    data = json.loads(body[0])
+    if path is not None:
+        os.makedirs(cache_folder, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(body[0])
+        os.replace(path + ".tmp", path)
+
+    return data
+
+
+def run_pool(fn, jobs, workers, desc):
+    """
+    Runs fn(session, *job) for every job with at most `workers` in flight, every worker thread
+    has its own requests.Session. The results keep the order of jobs.
+    """
+    local = threading.local()
+    results = [None] * len(jobs)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(lambda job: fn(_session(local), *job), job): i for i, job in enumerate(jobs)}
+
+        with tqdm(total=len(jobs), desc=desc) as progress:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+                progress.update(1)
+                progress.set_postfix(failed=sum(r is not None and r["error"] is not None for r in results))
+
+    return results
+
+
+def download_files(jobs, workers=8, retries=3, backoff=1.0, timeout=60, desc="Downloading..."):
+    """
+    Downloads all (url, path) jobs with at most `workers` requests in flight.
+    Returns the results of download_file in the order of jobs.
+    """
+    def run(session, url, path):
+        return download_file(url, path, session=session, retries=retries, backoff=backoff, timeout=timeout)
+
+    return run_pool(run, list(jobs), workers, desc)
+
+
+def check_files(urls, workers=8, retries=3, backoff=1.0, timeout=30, desc="Checking..."):
+    """
+    Sends a HEAD request for all urls with at most `workers` requests in flight.
+    Returns the results of head_file in the order of urls.
+    """
+    def run(session, url):
+        return head_file(url, session=session, retries=retries, backoff=backoff, timeout=timeout)
+
+    return run_pool(run, [(url,) for url in urls], workers, desc)
+
+
+def summarize(results, wall_seconds=None):
+    """
+    Short summary of download_files results: files ok / failed, bytes, retries and throughput.
+    """
+    ok = [r for r in results if r["error"] is None]
+    failed = [r for r in results if r["error"] is not None]
+    size = sum(r["bytes"] for r in ok)
+    retried = sum(max(r["attempts"] - 1, 0) for r in results)
+
+    lines = [f"Downloaded {len(ok)}/{len(results)} files ({size / 1e6:.1f} MB, {retried} retries)"]
+    if wall_seconds:
+        lines[0] += f" in {wall_seconds:.1f}s ({size / 1e6 / wall_seconds:.1f} MB/s)"
+
+    for r in failed:
+        lines.append(f"Failed to download: {os.path.basename(r.get('path') or r['url'])} ({r['error']}, {r['attempts']} attempts)")
+
+    return "\n".join(lines)
@@ -1,15 +1,277 @@
 import os
-import requests
+import json
+import time
 from pathlib import Path
 import argparse
 import zipfile
-from tqdm import tqdm
 import polars as pl
 import shutil
-from io import StringIO
+from data_io.fetch.download import head_file, is_unchanged, resume_download, run_pool, sha256_file, summarize, write_archive
+from data_io.formats.formats import ACCIDENT_FORMAT
 
+BASE_URL = "https://www.opengeodata.nrw.de/produkte/transport_verkehr/unfallatlas/"
 
-if __name__ == "__main__":
+# as we live in germany we have the multiple data formats which we need to unify...
+# rename colums if needed
+NEW_NAMES = {
+    "ULAND": "state",
+    "UREGBEZ": "region",
+    "UKREIS": "district",
+    "UGEMEINDE": "municipality",
+    "UJAHR": "year",
+    "UMONAT": "month",
+    "UWOCHENTAG": "weekday",
+    "USTUNDE": "hour",
+    "UTYP1": "accident_type",
+    "UKATEGORIE": "injury_severity",
+    "ULICHTVERH": "light_condition",
+    "LICHT" : "light_condition",
+    "IstStrasse": "road_condition",
+    "STRZUSTAND": "road_condition",
+    "IstStrassenzustand": "road_condition",
+    "IstRad": "is_bicycle",
+    "IstPKW": "is_car",
+    "IstFuss": "is_pedestrian",
+    "IstKrad": "is_motorcycle",
+    "IstSonstige": "is_other",
+    "IstSonstig": "is_other",
+    "YGCSWGS84": "latitude",
+    "XGCSWGS84": "longitude",
+    "LINREFX": "LINREFX",
+    "LINREFY": "LINREFY",
+}
+
+# trucks are counted as "other" (combined by OR), only some years have the column
+TRUCK_COLUMN = "IstGkfz"
+
+# per year: remote version, size and sha256 of the zip and size and sha256 of the written Parquet file ("output").
+# Kept next to the processed files, a year whose output matches its record is not processed again
+# unless the remote zip changed. Older runs kept it in the raw folder (only with --keep-raw)
+MANIFEST_NAME = "downloads.json"
+
+
+def load_manifest(folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def file_record(path):
+    return {"size": os.path.getsize(path), "sha256": sha256_file(path)}
+
+
+def output_matches(path, entry):
+    # the Parquet file of a year is the one written by the run that recorded entry
+    record = (entry or {}).get("output")
+    if record is None or not os.path.exists(path) or os.path.getsize(path) != record.get("size"):
+        return False
+    return sha256_file(path) == record.get("sha256")
+
+
+def is_valid_zip(path):
+    try:
+        with zipfile.ZipFile(path, "r") as zip_ref:
+            # CRC of every member
+            return zip_ref.testzip() is None
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def local_copy(zip_path, entry):
+    """
+    True if zip_path is a complete download: it matches the size and sha256 recorded for it or, without a
+    record (e.g. kept by an older run), it is a readable zip. Returns (valid, sha256).
+    """
+    if not os.path.exists(zip_path):
+        return False, None
+    if entry is not None:
+        if os.path.getsize(zip_path) != entry.get("size"):
+            return False, None
+        digest = sha256_file(zip_path)
+        return digest == entry.get("sha256"), digest
+    if is_valid_zip(zip_path):
+        return True, sha256_file(zip_path)
+    return False, None
+
+
+def projection(columns):
+    """
+    Maps the columns of one year's file to the ACCIDENT_FORMAT names, only the columns
+    that are kept are read at all. The first matching source column wins.
+    """
+    rename = {}
+    for col in columns:
+        new_name = NEW_NAMES.get(col)
+        if new_name is not None and new_name not in rename.values():
+            rename[col] = new_name
+    return rename
+
+
+def raw_schema(header):
+    """
+    Types of the columns of one year's file: the columns that are processed are parsed as their
+    ACCIDENT_FORMAT type, all others are kept as strings.
+    """
+    schema = {col: pl.String for col in header}
+    schema.update({old: ACCIDENT_FORMAT[new] for old, new in projection(header).items()})
+    if TRUCK_COLUMN in header:
+        schema[TRUCK_COLUMN] = pl.Int32
+    return schema
+
+
+def scan_year(csv_path):
+    # one extracted Unfallatlas file (semicolon separated, decimal comma), unparsable values become null
+    header = pl.read_csv(csv_path, separator=";", n_rows=0).columns
+    return pl.scan_csv(
+        csv_path,
+        separator=";",
+        decimal_comma=True,
+        schema=raw_schema(header),
+        ignore_errors=True,
+    )
+
+
+def accident_table(lf):
+    """
+    Maps the raw columns of one year (scan_year or the archive) to the columns of ACCIDENT_FORMAT,
+    missing columns are null. Only the columns that are kept are read at all.
+    """
+    header = lf.collect_schema().names()
+    rename = projection(header)
+
+    lf = lf.select(list(rename) + ([TRUCK_COLUMN] if TRUCK_COLUMN in header else [])).rename(rename)
+
+    if TRUCK_COLUMN in header:
+        lf = lf.with_columns((pl.col("is_other") | pl.col(TRUCK_COLUMN)).alias("is_other"))
+
+    return lf.select([
+        (pl.col(col) if col in rename.values() else pl.lit(None)).cast(dtype).alias(col)
+        for col, dtype in ACCIDENT_FORMAT.items()
+    ])
+
+
+def convert_year(csv_path, parquet_path, archive_path=None):
+    """
+    Streams one extracted Unfallatlas file into a typed Parquet file with the columns of ACCIDENT_FORMAT.
+    With archive_path all columns of the file are also stored there (raw names, see raw_schema) and the
+    table is written from the archive. Returns the number of rows.
+    """
+    lf = scan_year(csv_path)
+    if archive_path is not None:
+        write_archive(lf, archive_path)
+        lf = pl.scan_parquet(archive_path)
+
+    accident_table(lf).sink_parquet(parquet_path)
+
+    return pl.scan_parquet(parquet_path).select(pl.len()).collect().item()
+
+
+def fetch_year(session, year, raw_folder, output_folder, base_url=BASE_URL, retries=3, entry=None, archive_folder=None):
+    """
+    Downloads the zip of one year (unless a valid local copy exists, see local_copy) and writes its accident
+    table to accidents_<year>.parquet. An interrupted download is continued by the next attempt or run.
+    entry is the manifest record of the year, the result has the fields of the new record. If accidents_<year>.parquet
+    still matches the record, only a HEAD request checks whether the remote zip changed. A local zip is only used
+    if it is still the remote version it was recorded with.
+    With archive_folder the raw table is stored there as <year>.parquet (see convert_year).
+    """
+    # The URL pattern is: https://www.opengeodata.nrw.de/produkte/transport_verkehr/unfallatlas/Unfallorte2024_EPSG25832_CSV.zip
+    file_name = f"Unfallorte{year}_EPSG25832_CSV.zip"
+    zip_path = os.path.join(raw_folder, file_name)
+    parquet_path = os.path.join(output_folder, f"accidents_{year}.parquet")
+    archive_path = os.path.join(archive_folder, f"{year}.parquet") if archive_folder is not None else None
+
+    check = None
+    if output_matches(parquet_path, entry) and (archive_path is None or os.path.exists(archive_path)):
+        check = head_file(base_url + file_name, session=session, retries=retries)
+        # the output is kept if the server can not be reached
+        if check["error"] is not None or is_unchanged(entry, check):
+            result = {"url": base_url + file_name, "path": zip_path, "status": check["status"], "bytes": 0,
+                      "attempts": 0, "seconds": 0.0, "error": None, "resumed": 0, "skipped": True,
+                      "output": entry["output"], "rows": pl.scan_parquet(parquet_path).select(pl.len()).collect().item()}
+            result.update({k: entry.get(k) for k in ("size", "sha256", "etag", "last_modified")})
+            return result
+
+    valid, digest = local_copy(zip_path, entry)
+    if valid and entry is not None:
+        if check is None:
+            check = head_file(base_url + file_name, session=session, retries=retries)
+        # a zip of an older remote version is downloaded again (kept if the server can not be reached)
+        valid = check["error"] is not None or is_unchanged(entry, check)
+
+    if valid:
+        result = {"url": base_url + file_name, "path": zip_path, "status": None, "bytes": 0, "attempts": 0,
+                  "seconds": 0.0, "error": None, "sha256": digest, "resumed": 0, "skipped": False,
+                  "size": os.path.getsize(zip_path)}
+        result.update({k: (entry or {}).get(k) for k in ("etag", "last_modified")})
+    else:
+        result = resume_download(base_url + file_name, zip_path, session=session, retries=retries, expected=entry)
+        result["skipped"] = False
+        if result["error"] is None and not is_valid_zip(zip_path):
+            os.remove(zip_path)
+            result["error"] = "invalid zip file"
+
+    result["rows"] = 0
+    result["output"] = None
+    if result["error"] is not None:
+        return result
+
+    # grab only the text file from the zip
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for file in zip_ref.namelist():
+            if file.endswith('.txt') or file.endswith('.csv'):
+                extracted_path = zip_ref.extract(file, os.path.join(raw_folder, str(year)))
+
+                result["rows"] = convert_year(extracted_path, parquet_path, archive_path=archive_path)
+                result["output"] = file_record(parquet_path)
+                os.remove(extracted_path)  # remove the extracted txt file
+
+    return result
+
+
+def remove_old_csv(output_folder, year):
+    # a csv of the same year from an older fetch would be read as well
+    old_csv = os.path.join(output_folder, f"accidents_{year}.csv")
+    if os.path.exists(old_csv):
+        os.remove(old_csv)
+
+
+def process_archive(years, archive_folder, output_folder):
+    """
+    Writes accidents_<year>.parquet again from the years stored in archive_folder, without downloading.
+    The new outputs are recorded in the manifest of output_folder.
+    """
+    manifest = load_manifest(output_folder)
+
+    for year in years:
+        archive_path = os.path.join(archive_folder, f"{year}.parquet")
+        if not os.path.exists(archive_path):
+            print(f"{year}: not archived")
+            continue
+
+        parquet_path = os.path.join(output_folder, f"accidents_{year}.parquet")
+        accident_table(pl.scan_parquet(archive_path)).sink_parquet(parquet_path)
+        remove_old_csv(output_folder, year)
+        if str(year) in manifest:
+            manifest[str(year)]["output"] = file_record(parquet_path)
+        print(f"{year}: {pl.scan_parquet(parquet_path).select(pl.len()).collect().item()} accidents")
+
+    save_manifest(output_folder, manifest)
+
+
+def main(argv=None):
     # command line interface for start and end year
     parser = argparse.ArgumentParser(description="Download accident data from Unfallatlas.")
     parser.add_argument("--start_year", default=2016, type=int, help="Start year for data download (inclusive, available from 2016).")
@@ -17,9 +279,14 @@ if __name__ == "__main__":
     # add the folder argument
     parser.add_argument("--folder", default="data/", type=str, help="Folder to save downloaded data.")
     parser.add_argument("--keep-raw", default=False, action='store_true', help="Whether to keep raw downloaded zip files.")
-    args = parser.parse_args()
-
-    BASE_URL = "https://www.opengeodata.nrw.de/produkte/transport_verkehr/unfallatlas/"
+    parser.add_argument("--workers", default=4, type=int, help="Number of years processed concurrently.")
+    parser.add_argument("--retries", default=3, type=int, help="Retries per file on connection errors and 429/5xx responses.")
+    parser.add_argument("--base-url", default=BASE_URL, type=str, help="Server to download from (e.g. a local mirror).")
+    parser.add_argument("--archive", default=False, action='store_true',
+                        help="Also store every year as compressed Parquet in data/archive/accidents/ (typed, not processed).")
+    parser.add_argument("--from-archive", default=False, action='store_true',
+                        help="Do not download, process the years stored with --archive again.")
+    args = parser.parse_args(argv)
 
     start_year = args.start_year
     end_year = args.end_year
@@ -27,97 +294,59 @@ if __name__ == "__main__":
 
     raw_folder = os.path.join(folder, "raw/accidents/")
     output_folder = os.path.join(folder, "processed/accidents/")
+    archive_folder = os.path.join(folder, "archive/accidents/")
+
+    if args.from_archive:
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+        process_archive(range(start_year, end_year + 1), archive_folder, output_folder)
+        print("Data processing completed.")
+        return
 
     # create the folder if it does not exist
     Path(raw_folder).mkdir(parents=True, exist_ok=True)
     Path(output_folder).mkdir(parents=True, exist_ok=True)
+    if args.archive:
+        Path(archive_folder).mkdir(parents=True, exist_ok=True)
 
-    # The URL pattern is: https://www.opengeodata.nrw.de/produkte/transport_verkehr/unfallatlas/Unfallorte2024_EPSG25832_CSV.zip
-    for year in tqdm(range(start_year, end_year + 1), desc="Downloading..."):
-        file_name = f"Unfallorte{year}_EPSG25832_CSV.zip"
-        url = BASE_URL + file_name
-        
-        response = requests.get(url, stream=True)
-
-        if response.status_code == 200:
-            zip_path = os.path.join(raw_folder, file_name)
-            with open(zip_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            # grab only the text file from the zip and save it as a csv
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                for file in zip_ref.namelist():
-                    if file.endswith('.txt') or file.endswith('.csv'):
-                        extracted_path = zip_ref.extract(file, raw_folder)
-                        # replace , with . in the extracted file to fix decimal format
-                        with open(extracted_path, 'r', encoding='utf-8') as f:
-                            content = f.read().replace(',', '.')
-
-                        #transform the content into a polars dataframe
-                        content = StringIO(content)
-                        
-                        df = pl.read_csv(content, separator=';', ignore_errors=True, n_threads=4)
-
-                        # as we live in germany we have the multiple data formats which we need to unify...
-                        # rename colums if needed
-                        new_names = {
-                            "ULAND": "state",
-                            "UREGBEZ": "region",
-                            "UKREIS": "district",
-                            "UGEMEINDE": "municipality",
-                            "UJAHR": "year",
-                            "UMONAT": "month",
-                            "UWOCHENTAG": "weekday",
-                            "USTUNDE": "hour",
-                            "UTYP1": "accident_type",
-                            "UKATEGORIE": "injury_severity",
-                            "ULICHTVERH": "light_condition",
-                            "LICHT" : "light_condition",
-                            "IstStrasse": "road_condition",
-                            "STRZUSTAND": "road_condition",
-                            "IstStrassenzustand": "road_condition",
-                            "IstRad": "is_bicycle",
-                            "IstPKW": "is_car",
-                            "IstFuss": "is_pedestrian",
-                            "IstKrad": "is_motorcycle",
-                            "IstSonstige": "is_other",
-                            "IstSonstig": "is_other",
-                            "YGCSWGS84": "latitude",
-                            "XGCSWGS84": "longitude"
-                        }
-
-                        # iterate over the new_names and rename if the old name exists in the dataframe
-                        rename_dict = {}
-                        for old_name, new_name in new_names.items():
-                            if old_name in df.columns:
-                                rename_dict[old_name] = new_name
-                        if rename_dict:
-                            df = df.rename(rename_dict)
-
-                        # if "IstGkfz" exists we want to combine itz with "is_other" by OR operation
-                        if "IstGkfz" in df.columns:
-                            df = df.with_columns((pl.col("is_other") | pl.col("IstGkfz")).alias("is_other"))
-                            df = df.drop("IstGkfz") 
-
-                        # use only relevant columns
-                        relevant_columns = [
-                            "state", "region", "district", "municipality", "year", "month", "weekday", "hour",
-                            "accident_type", "injury_severity", "light_condition", "road_condition",
-                            "is_bicycle", "is_car", "is_pedestrian", "is_motorcycle", "is_other",
-                            "LINREFX", "LINREFY", "latitude", "longitude"
-                        ]
-
-                        df = df.select([col for col in relevant_columns if col in df.columns])
-
-                        csv_save_path = os.path.join(output_folder, f"accidents_{year}.csv")
-                        df.write_csv(csv_save_path)
-                        os.remove(extracted_path)  # remove the extracted txt file
-        else:
-            print(f"Failed to download: {file_name} (Status code: {response.status_code})")
+    manifest = load_manifest(output_folder) or load_manifest(raw_folder)
+    years = list(range(start_year, end_year + 1))
+
+    def run(session, year, entry):
+        return fetch_year(
+            session, year, raw_folder, output_folder, base_url=args.base_url, retries=args.retries, entry=entry,
+            archive_folder=archive_folder if args.archive else None,
+        )
 
+    start = time.perf_counter()
+    results = run_pool(run, [(year, manifest.get(str(year))) for year in years], args.workers, desc="Downloading...")
+    print(summarize(results, wall_seconds=time.perf_counter() - start))
+
+    skipped = sum(r["skipped"] for r in results)
+    resumed = sum(r["resumed"] > 0 for r in results)
+    if skipped or resumed:
+        print(f"{skipped} years up to date, {resumed} resumed downloads")
+
+    for year, result in zip(years, results):
+        if result["error"] is None:
+            manifest[str(year)] = {k: result.get(k) for k in ("size", "sha256", "etag", "last_modified", "output")}
+            remove_old_csv(output_folder, year)
+            print(f"{year}: {result['rows']} accidents")
+
+    save_manifest(output_folder, manifest)
 
     if not args.keep_raw:
-        print("Removing raw downloaded files...")
-        shutil.rmtree(raw_folder)
+        if all(r["error"] is None for r in results):
+            print("Removing raw downloaded files...")
+            shutil.rmtree(raw_folder)
+        else:
+            # the partial downloads (.part) of the failed years are kept, the next run continues them
+            print("Removing complete raw downloaded files...")
+            for result in results:
+                if os.path.exists(result["path"]):
+                    os.remove(result["path"])
 
-    print("Data processing completed.")
\ No newline at end of file
+    print("Data processing completed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,98 @@
-# automates data loading by running all fetch scripts
-import subprocess
-
-scripts = [
-    "data_io/fetch/fetch_accident_data.py",
-    "data_io/fetch/fetch_cycle_data.py",
-    "data_io/fetch/fetch_weather_data.py",
-    "data_io/fetch/fetch_holidays.py",
-]
-
-for script in scripts:
-    result = subprocess.run(["uv", "run", script], check=False)
-    if result.returncode != 0:
-        print(f"{script} failed.\n")
-    else:
-        print(f"{script} completed successfully.\n")
-
-print("Data loading finished.")
+# automates data loading by running all fetch scripts as stages of one in-process pipeline
+import os
+import argparse
+import polars as pl
+from data_io.fetch import fetch_accident_data, fetch_cycle_data, fetch_holidays, fetch_weather_data
+from data_io.fetch.pipeline import Stage, run_pipeline
+from data_io.loader.manifest import DatasetManifest
+
+FETCH_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def _code(*files):
+    # a stage is re-run if its script or the shared helpers changed
+    return [os.path.join(FETCH_FOLDER, f) for f in (*files, "download.py")]
+
+
+def build_stages(folder="data/", incremental=False, archive=False, from_archive=False):
+    """
+    The four data sources, they do not depend on each other and run concurrently.
+    The dataset manifest is updated once all of them are done.
+    archive / from_archive are passed to the accident and cycle counter scripts.
+    """
+    processed = os.path.join(folder, "processed")
+
+    def stage(name, module, code, outputs, argv):
+        return Stage(name, lambda: module.main(argv), outputs=outputs, inputs=_code(code), params=argv)
+
+    archive_argv = (["--archive"] if archive else []) + (["--from-archive"] if from_archive else [])
+    accident_argv = ["--folder", folder] + archive_argv
+    cycle_argv = ["--folder", folder] + (["--incremental"] if incremental else []) + archive_argv
+
+    return [
+        stage(
+            "accidents", fetch_accident_data, "fetch_accident_data.py",
+            [os.path.join(processed, "accidents", "accidents_*.parquet")],
+            accident_argv,
+        ),
+        stage(
+            "cycle_counter", fetch_cycle_data, "fetch_cycle_data.py",
+            [os.path.join(processed, "cycle_counter", "*", "station_*.csv")],
+            cycle_argv,
+        ),
+        stage(
+            "weather", fetch_weather_data, "fetch_weather_data.py",
+            [os.path.join(processed, "weather", "weather_*.csv")],
+            ["--folder", folder],
+        ),
+        stage(
+            "holidays", fetch_holidays, "fetch_holidays.py",
+            [os.path.join(processed, "holidays", "schulferien_holidays_bw.csv")],
+            ["--folder", folder],
+        ),
+        Stage(
+            "manifest",
+            lambda: DatasetManifest(processed).update(),
+            outputs=[os.path.join(processed, "manifest.json")],
+            inputs=[os.path.join(FETCH_FOLDER, "..", "loader", "manifest.py")],
+            deps=["accidents", "cycle_counter", "weather", "holidays"],
+        ),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch and process all data sources.")
+    parser.add_argument("--folder", default="data/", type=str, help="Folder to save downloaded data.")
+    parser.add_argument("--workers", default=4, type=int, help="Number of stages run concurrently.")
+    parser.add_argument("--force", default=False, action="store_true", help="Run all stages, even if their outputs are up to date.")
+    parser.add_argument("--only", nargs="+", default=None, help="Run only these stages (and what they depend on).")
+    parser.add_argument("--max-age", default=None, type=float, help="Re-run stages whose newest output is older than this many days.")
+    parser.add_argument("--incremental", default=False, action="store_true", help="Incremental refresh of the cycle counter data.")
+    parser.add_argument("--archive", default=False, action="store_true", help="Also store the raw accident and cycle counter data as compressed Parquet in data/archive/.")
+    parser.add_argument("--from-archive", default=False, action="store_true", help="Process the accident and cycle counter data stored with --archive again instead of downloading it.")
+    args = parser.parse_args(argv)
+
+    log_folder = os.path.join(args.folder, "logs")
+    report = run_pipeline(
+        build_stages(args.folder, incremental=args.incremental, archive=args.archive, from_archive=args.from_archive),
+        workers=args.workers,
+        force=args.force,
+        only=args.only,
+        max_age=args.max_age * 86400 if args.max_age is not None else None,
+        log_path=os.path.join(log_folder, "fetch_runs.jsonl"),
+        state_path=os.path.join(log_folder, "fetch_state.json"),
+    )
+
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True):
+        print(report.select("stage", "status", "seconds", "files", "bytes", "rows", "error"))
+
+    failed = report.filter(pl.col("status").is_in(["failed", "blocked"]))
+    for stage, error in failed.select("stage", "error").iter_rows():
+        print(f"{stage} failed: {error}")
+
+    print("Data loading finished.")
+    return report
+
+
+if __name__ == "__main__":
+    main()
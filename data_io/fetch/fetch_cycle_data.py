@@ -1,153 +1,384 @@
 # This is a script to automate the data downloading process from https://mobidata-bw.de/fahrradzaehldaten/v2/ where we download bicycle counting data for specified years and months.
 
 import os
-import requests
+import glob
+import json
+import time
 from pathlib import Path
 import argparse
-import gzip
 from tqdm import tqdm
 import polars as pl
 import shutil
+from data_io.fetch.download import archive_metadata, check_files, fetch_file, is_unchanged, iter_csv_gz, run_pool, summarize, write_archive
 
+BASE_URL = "https://mobidata-bw.de/fahrradzaehldaten/v2/"
 
-if __name__ == "__main__":
+# currently one month contains the monthly data for several cities and stations.
+CITY_INDEX = "domain_name"
+STATION_INDEX = "counter_site_id"
+TIMESTAMP_INDEX = "iso_timestamp"
+
+RAW_SCHEMA = {
+    "operator_name": pl.String,
+    "domain_name": pl.String,
+    "domain_id": pl.Int32,
+    "counter_site": pl.String,
+    "counter_site_id": pl.Int32,
+    "counter_serial": pl.String,
+    "longitude": pl.Float64,
+    "latitude": pl.Float64,
+    "timezone": pl.String,
+    "iso_timestamp": pl.String,
+    "channels_in": pl.Int32,
+    "channels_out": pl.Int32,
+    "channels_all": pl.Int32,
+    "channels_unknown": pl.Int32,
+    "site_temperature": pl.Float64,
+    "site_rain_accumulation": pl.Float64,
+    "site_snow_accumulation": pl.Float64,
+}
+
+# remote version (ETag, Last-Modified, size) of every month that went into the partitioned dataset
+MANIFEST_NAME = "downloads.json"
+
+
+def month_file(year, month):
+    return f"fahrradzaehler_stundenwerten_{year}{month:02d}.csv.gz"
+
+
+def month_of(file_name):
+    # fahrradzaehler_stundenwerten_202101.csv.gz -> 202101
+    return file_name.rsplit("/", 1)[-1].split("_")[-1].split(".")[0]
+
+
+def station_dir(part_folder, city, station):
+    return os.path.join(part_folder, f"city={str(city).replace(' ', '_')}", f"station={station}")
+
+
+def remove_month(part_folder, month):
+    """
+    Removes the parts of a month, they are always replaced as a whole.
+    Returns the (city, station) pairs that had parts (city as in the folder name).
+    """
+    removed = set()
+    for path in glob.glob(os.path.join(part_folder, "city=*", "station=*", "year=*", f"{month}-*.parquet")):
+        os.remove(path)
+        city, station = path.split(os.sep)[-4:-2]
+        removed.add((city.split("=", 1)[1], station.split("=", 1)[1]))
+    return removed
+
+
+def write_parts(df, part_folder, month, batch):
+    """
+    Appends one parsed batch to the partitioned dataset, one Parquet file per city, station and year:
+    city=<city>/station=<id>/year=<yyyy>/<yyyymm>-<batch>.parquet
+    Returns the (city, station) pairs that were written.
+    """
+    df = df.with_columns(pl.col(TIMESTAMP_INDEX).str.slice(0, 4).alias("_year"))
+
+    written = set()
+    for (city, station, year), group in df.group_by([CITY_INDEX, STATION_INDEX, "_year"]):
+        folder = os.path.join(station_dir(part_folder, city, station), f"year={year}")
+        os.makedirs(folder, exist_ok=True)
+
+        group.drop("_year").write_parquet(os.path.join(folder, f"{month}-{batch:03d}.parquet"))
+        written.add((city, station))
+
+    return written
+
+
+def load_manifest(folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def changed_months(file_names, manifest, base_url=BASE_URL, workers=8, retries=3):
+    """
+    HEAD requests for all months, returns the file names that are missing from the manifest or changed remotely.
+    Months the server does not have (404) are skipped.
+    """
+    checks = check_files([base_url + name for name in file_names], workers=workers, retries=retries)
+
+    changed = []
+    for name, check in zip(file_names, checks):
+        if check["error"] is None and not is_unchanged(manifest.get(name), check):
+            changed.append(name)
+    return changed
+
+
+def fix_channels(df):
+    # Fix channels:
+    # Override channels all only if channels_in and channels_out are not null, else:
+    # Some cities only implement channels_unknown and leave the others empty, in this case, put the data into channels_all
+    return df.with_columns([
+        pl.when(
+            (pl.col("channels_in").is_not_null()) & (pl.col("channels_out").is_not_null())
+        )
+        .then(pl.col("channels_in") + pl.col("channels_out"))
+        .otherwise(pl.col("channels_unknown"))
+        .alias("channels_all")
+    ])
+
+
+def process_batches(batches, part_folder, month, archive_parts=None):
+    """
+    Appends the parsed batches of one month to the partitioned dataset (replacing the month).
+    With archive_parts the untransformed batches are written there as well, see archive_month.
+    Returns the (city, station) pairs that were written or had parts of the month before.
+    """
+    # a station missing from the new version of the month still needs its station file rewritten
+    stations = remove_month(part_folder, month)
+    if archive_parts is not None:
+        shutil.rmtree(archive_parts, ignore_errors=True)
+        os.makedirs(archive_parts)
+
+    for i, batch in enumerate(batches):
+        if archive_parts is not None:
+            batch.write_parquet(os.path.join(archive_parts, f"{i:05d}.parquet"))
+        stations.update(write_parts(fix_channels(batch), part_folder, month, i))
+    return stations
+
+
+def archive_month(archive_parts, archive_path, version):
+    # one compressed file per month, the remote version is kept for --from-archive
+    files = sorted(glob.glob(os.path.join(archive_parts, "*.parquet")))
+    lf = pl.scan_parquet(files) if files else pl.LazyFrame(schema=RAW_SCHEMA)
+    write_archive(lf, archive_path, metadata=version)
+    shutil.rmtree(archive_parts)
+
+
+def fetch_month(session, url, part_folder, raw_path=None, retries=3, archive_path=None):
+    """
+    Streams one monthly archive, decompresses and parses it on the fly and appends every batch to the
+    partitioned dataset right away, so at most one batch per month is held in memory.
+    With archive_path the parsed month is also stored there as compressed Parquet (see download.write_archive).
+    Returns the result of fetch_file with "stations": the (city, station) pairs that were written.
+    """
+    month = month_of(url)
+    stations = set()
+    archive_parts = archive_path + ".parts" if archive_path is not None else None
+
+    def parse(response):
+        # a retry (or a changed month) starts over
+        stations.clear()
+        batches = iter_csv_gz(response, raw_path=raw_path, separator=",", ignore_errors=True, schema=RAW_SCHEMA)
+        stations.update(process_batches(batches, part_folder, month, archive_parts=archive_parts))
+        return response.raw.tell()
+
+    result = fetch_file(url, parse, session=session, retries=retries)
+    result["path"] = raw_path
+    result["stations"] = stations
+
+    if result["error"] is not None:
+        remove_month(part_folder, month)
+    elif archive_path is not None:
+        version = {
+            "etag": result["etag"],
+            "last_modified": result["last_modified"],
+            "size": result["size"] if result["size"] is not None else result["bytes"],
+        }
+        archive_month(archive_parts, archive_path, version)
+
+    if archive_parts is not None:
+        shutil.rmtree(archive_parts, ignore_errors=True)
+    return result
+
+
+def fetch_months(file_names, part_folder, raw_folder=None, base_url=BASE_URL, workers=8, retries=3, archive_folder=None):
+    """
+    Downloads and parses the given monthly files concurrently into the partitioned dataset below part_folder,
+    without intermediate files. With raw_folder the .csv.gz archives are stored there as well, with
+    archive_folder the parsed months as <yyyymm>.parquet.
+    """
+    # The request looks like https://mobidata-bw.de/fahrradzaehldaten/v2/fahrradzaehler_stundenwerten_202101.csv.gz where 202101 is year and month
+    jobs = [
+        (
+            base_url + name,
+            os.path.join(raw_folder, name) if raw_folder is not None else None,
+            os.path.join(archive_folder, f"{month_of(name)}.parquet") if archive_folder is not None else None,
+        )
+        for name in file_names
+    ]
+
+    def run(session, url, raw_path, archive_path):
+        return fetch_month(session, url, part_folder, raw_path=raw_path, retries=retries, archive_path=archive_path)
+
+    start = time.perf_counter()
+    results = run_pool(run, jobs, workers, desc="Downloading...")
+
+    # failed months are usually months without data (404)
+    print(summarize(results, wall_seconds=time.perf_counter() - start))
+    return results
+
+
+def process_archive(file_names, part_folder, archive_folder, batch_rows=500_000):
+    """
+    Rebuilds the partitioned dataset from the months in archive_folder without downloading anything,
+    read in slices of batch_rows rows. Returns results shaped like those of fetch_months,
+    months without archive are missing.
+    """
+    results = []
+    for name in tqdm(file_names, desc="Processing archive..."):
+        month = month_of(name)
+        path = os.path.join(archive_folder, f"{month}.parquet")
+        if not os.path.exists(path):
+            continue
+
+        rows = pl.scan_parquet(path).select(pl.len()).collect().item()
+        batches = (pl.scan_parquet(path).slice(offset, batch_rows).collect() for offset in range(0, rows, batch_rows))
+
+        version = archive_metadata(path)
+        results.append({
+            "url": name,
+            "error": None,
+            "stations": process_batches(batches, part_folder, month),
+            "etag": version.get("etag"),
+            "last_modified": version.get("last_modified"),
+            "size": int(version["size"]) if "size" in version else None,
+            "bytes": os.path.getsize(path),
+        })
+
+    print(f"Processed {len(results)}/{len(file_names)} months from {archive_folder}")
+    return results
+
+
+def write_stations(stations, part_folder, proc_folder):
+    """
+    Saves each city and station combination into a separate csv file, streamed from its partitions in
+    month order. Rows with the same counter_site_id and iso_timestamp are kept once, the later month wins.
+    Returns the paths of the written files.
+    """
+    written = []
+
+    # the pairs of remove_month have the city of the folder name and the station as string
+    stations = {(str(city).replace(" ", "_"), str(station)) for city, station in stations}
+
+    for city, station in tqdm(sorted(stations), desc="Saving processed data..."):
+        files = sorted(glob.glob(os.path.join(station_dir(part_folder, city, station), "year=*", "*.parquet")))
+        if not files:
+            continue
+
+        city_folder = os.path.join(proc_folder, str(city).replace(" ", "_"))
+        Path(city_folder).mkdir(parents=True, exist_ok=True)
+
+        station_file = os.path.join(city_folder, f"station_{station}.csv")
+        (
+            pl.scan_parquet(files, hive_partitioning=False)
+            .unique(subset=[STATION_INDEX, TIMESTAMP_INDEX], keep="last", maintain_order=True)
+            .sink_csv(station_file)
+        )
+        written.append(station_file)
+
+    return written
+
+
+def main(argv=None):
     # command line interface for start and end year
     parser = argparse.ArgumentParser(description="Download bicycle counting data.")
     parser.add_argument("--start_year", default=2013, type=int, help="Start year for data download (inclusive).")
     parser.add_argument("--end_year", default=2025, type=int, help="End year for data download (inclusive).")
     # add the folder argument
     parser.add_argument("--folder", default="data/", type=str, help="Folder to save downloaded data.")
-    parser.add_argument("--keep-raw", default=False, action='store_true', help="Whether to keep raw downloaded zip files.")
-    args = parser.parse_args()
-
-    BASE_URL = "https://mobidata-bw.de/fahrradzaehldaten/v2/"
+    parser.add_argument("--keep-raw", default=False, action='store_true', help="Whether to also store the raw downloaded .csv.gz archives.")
+    parser.add_argument("--workers", default=8, type=int, help="Number of concurrent downloads.")
+    parser.add_argument("--retries", default=3, type=int, help="Retries per file on connection errors and 429/5xx responses.")
+    parser.add_argument("--base-url", default=BASE_URL, type=str, help="Server to download from (e.g. a local mirror).")
+    parser.add_argument("--incremental", default=False, action='store_true',
+                        help="Only download months that are new or changed remotely and merge them into the existing station files.")
+    parser.add_argument("--archive", default=False, action='store_true',
+                        help="Also store every month as compressed Parquet in data/archive/cycle_counter/ (typed, not processed). "
+                             "An existing archive is always updated with the downloaded months.")
+    parser.add_argument("--from-archive", default=False, action='store_true',
+                        help="Do not download, process the months stored with --archive again.")
+    args = parser.parse_args(argv)
 
     start_year = args.start_year
     end_year = args.end_year
     folder = args.folder
 
     raw_folder = os.path.join(folder, "raw", "cycle_counter")
+    proc_folder = os.path.join(folder, "processed", "cycle_counter")
+    # city=<city>/station=<id>/year=<yyyy>/*.parquet, the station csv files are written from it
+    part_folder = os.path.join(folder, "processed", "cycle_counter_partitioned")
+    archive_folder = os.path.join(folder, "archive", "cycle_counter")
 
-    # create the folder if it does not exist
-    Path(raw_folder).mkdir(parents=True, exist_ok=True)
+    file_names = [month_file(year, month) for year in range(start_year, end_year + 1) for month in range(1, 13)]
 
-    # The request looks like https://mobidata-bw.de/fahrradzaehldaten/v2/fahrradzaehler_stundenwerten_202101.csv.gz where 202101 is year and month
-    for year in tqdm(range(start_year, end_year + 1), desc="Downloading..."):
-        for month in range(1, 13):
-            date_str = f"{year}{month:02d}"
-            file_name = f"fahrradzaehler_stundenwerten_{date_str}.csv.gz"
-            save_name = f"bicycle_counts_{date_str}.csv"
-            url = BASE_URL + file_name
-            response = requests.get(url)
-
-            if response.status_code == 200:
-                file_path = os.path.join(raw_folder, file_name)
-                write_path = os.path.join(raw_folder, save_name)
-                
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
-
-
-                # also unpack the gz file and delete the original gz file
-                with gzip.open(file_path, 'rb') as f_in:
-                    with open(write_path, 'wb') as f_out:
-                        f_out.write(f_in.read())
-
-                os.remove(file_path)
-            else:
-                print(f"Failed to download: {file_name} (Status code: {response.status_code}) (possibly no data for this month)")
-
-    print("Data download completed.")
-
-    # Now we want to process the downloaded data further, currently one month contains the monthly data for several cities and stations.
-    CITY_INDEX =  "domain_name"
-    STATION_INDEX = "counter_site_id"
-    TIMESTAMP_INDEX = "iso_timestamp"
-
-
-    entries = {}
-
-    all_files = [f for f in os.listdir(raw_folder) if f.endswith('.csv')]
-
-    print(f"Preprocessing {len(all_files)} downloaded files...")
-    
-    # Go through all downloaded files and aggregate them by city and station, safe data by station in one large dataframe
-    for file in tqdm(all_files, desc="Processing files..."):
-        file_path = os.path.join(raw_folder, file)
-        df = pl.read_csv(file_path, separator=',' , n_threads=4, ignore_errors=True,
-            schema={
-                "operator_name": pl.String,
-                "domain_name": pl.String,
-                "domain_id": pl.Int32,
-                "counter_site": pl.String,
-                "counter_site_id": pl.Int32,
-                "counter_serial": pl.String,
-                "longitude": pl.Float64,
-                "latitude": pl.Float64,
-                "timezone": pl.String,
-                "iso_timestamp": pl.String,
-                "channels_in": pl.Int32,
-                "channels_out": pl.Int32,
-                "channels_all": pl.Int32,
-                "channels_unknown": pl.Int32,
-                "site_temperature": pl.Float64,
-                "site_rain_accumulation": pl.Float64,
-                "site_snow_accumulation": pl.Float64,
-            }
-        )
-        
-        # Fix channels:
-        # Override channels all only if channels_in and channels_out are not null, else:
-        # Some cities only implement channels_unknown and leave the others empty, in this case, put the data into channels_all
-        df = df.with_columns([
-            pl.when(
-                (pl.col("channels_in").is_not_null()) & (pl.col("channels_out").is_not_null())
-            )
-            .then(pl.col("channels_in") + pl.col("channels_out"))
-            .otherwise(pl.col("channels_unknown"))
-            .alias("channels_all")
-        ])
-
-        # go through all unique city and station combinations
-        for (city, station), group in df.group_by([CITY_INDEX, STATION_INDEX]):
-            if city not in entries:
-                entries[city] = {}
-
-            if station not in entries[city]:
-                entries[city][station] = []
-
-            entries[city][station].append(group)
-
-
-    # go through the entries and concatenate the dataframes for each city and station
-    for city in entries:
-        for station in entries[city]:
-            
-            try:
-                entries[city][station] = pl.concat(entries[city][station], how="diagonal")
-            except Exception as e:
-                print(f"\n❌ Error concatenating {city} - Station {station}: {e}")
+    if args.from_archive:
+        # the archived months replace theirs in the dataset (with the remote versions stored in the archive),
+        # the other months and their manifest entries are kept
+        manifest = load_manifest(part_folder)
+    elif args.incremental:
+        manifest = load_manifest(part_folder)
+        file_names = changed_months(file_names, manifest, base_url=args.base_url, workers=args.workers, retries=args.retries)
+        print(f"{len(file_names)} new or changed months.")
+    else:
+        # a full run starts from an empty dataset
+        shutil.rmtree(part_folder, ignore_errors=True)
+        manifest = {}
 
+    # an existing archive is updated with every downloaded month, --from-archive would restore older data otherwise
+    archive = args.archive or bool(glob.glob(os.path.join(archive_folder, "*.parquet")))
+    if archive and not args.archive and not args.from_archive:
+        print(f"Updating the archive in {archive_folder} as well.")
 
-    proc_folder = os.path.join(folder, "processed", "cycle_counter")
+    # create the folder if it does not exist, the archives are only stored with --keep-raw
+    if args.keep_raw:
+        Path(raw_folder).mkdir(parents=True, exist_ok=True)
+    if archive:
+        Path(archive_folder).mkdir(parents=True, exist_ok=True)
     Path(proc_folder).mkdir(parents=True, exist_ok=True)
+    Path(part_folder).mkdir(parents=True, exist_ok=True)
 
-    # save each city and station combination into a seperate file
-    for city in tqdm(entries, desc="Saving processed data..."):
-        city_folder = os.path.join(proc_folder, city.replace(" ", "_"))
-        Path(city_folder).mkdir(parents=True, exist_ok=True)
-
-        for station in entries[city]:
-            station_file = os.path.join(city_folder, f"station_{station}.csv")
-            entries[city][station].write_csv(station_file)
+    if args.from_archive:
+        results = process_archive(file_names, part_folder, archive_folder)
+    else:
+        results = fetch_months(
+            file_names,
+            part_folder,
+            raw_folder=raw_folder if args.keep_raw else None,
+            base_url=args.base_url,
+            workers=args.workers,
+            retries=args.retries,
+            archive_folder=archive_folder if archive else None,
+        )
+        print("Data download completed.")
 
-    # now save each city and station combination into a seperate file
-    print("Saving processed data...")
+    stations = set().union(*(r["stations"] for r in results))
+    written = write_stations(stations, part_folder, proc_folder)
+    print(f"Saved {len(written)} station files.")
 
+    # remember the remote version of every processed month for the next incremental run
+    for r in results:
+        name = r["url"].rsplit("/", 1)[-1]
+        if r["error"] is not None:
+            # the parts of a failed month were removed, fetch it again next time
+            manifest.pop(name, None)
+            continue
 
-    if not args.keep_raw:
-        print("Removing raw downloaded files...")
-        # remove raw folder and its contents
-        shutil.rmtree(raw_folder)
+        manifest[name] = {
+            "etag": r["etag"],
+            "last_modified": r["last_modified"],
+            # without Content-Length (chunked response) the downloaded bytes are the size
+            "size": r["size"] if r["size"] is not None else r["bytes"],
+        }
+    save_manifest(part_folder, manifest)
 
     print("Data processing completed.")
+
+
+if __name__ == "__main__":
+    main()
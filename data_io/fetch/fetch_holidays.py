@@ -106,7 +106,7 @@ def fetch_holidays(start_year, end_year, output_dir):
     print(f"Successfully saved holiday data to {output_file}")
 
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Fetch holiday data for Baden-Württemberg."
     )
@@ -116,8 +116,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--end-year", type=int, default=2027, help="End year for fetching holidays"
     )
+    parser.add_argument(
+        "--folder", type=str, default=None, help="Data folder (default: data/ of the project)"
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     output_directory = os.path.join(
         os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
@@ -125,6 +128,8 @@ if __name__ == "__main__":
         "processed",
         "holidays",
     )
+    if args.folder is not None:
+        output_directory = os.path.join(args.folder, "processed", "holidays")
 
     if int(args.start_year) < 2020:
         print("API DELIVERS NO DATA BEFORE 2020")
@@ -135,3 +140,7 @@ if __name__ == "__main__":
         print("API DELIVERS NO DATA BEFORE 2020")
     else:
         fetch_holidays(args.start_year, args.end_year, output_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,22 @@
 import os
-import requests
 from pathlib import Path
 import argparse
-from tqdm import tqdm
 import polars as pl
 from datetime import date, timedelta
 import time
+from data_io.fetch.download import get_json, run_pool
 
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
 
-def fetch_weather_data_for_year(year: int, start_month: int = 1, end_month: int = 12, start_day = 1, end_day = 31, latitude: float = 49.4093, longitude: float = 8.6942) -> pl.DataFrame:
+# responses keyed on the full request (lat, lon, date range, variables), see download.get_json
+CACHE_FOLDER = os.path.join("data", "cache", "open_meteo")
+
+# the archive is updated with a delay of a few days, more recent ranges are not cached
+ARCHIVE_DELAY = timedelta(days=7)
+
+
+def fetch_weather_data_for_year(year: int, start_month: int = 1, end_month: int = 12, start_day = 1, end_day = 31, latitude: float = 49.4093, longitude: float = 8.6942,
+                                cache_folder: str = CACHE_FOLDER, url: str = ARCHIVE_URL, session = None) -> pl.DataFrame:
 
     start_date = date(year, start_month, start_day)
     try:
@@ -18,8 +26,6 @@ def fetch_weather_data_for_year(year: int, start_month: int = 1, end_month: int
         next_year = year + (end_month // 12)
         end_date = date(next_year, next_month, 1) - timedelta(days=1)
 
-    url = "https://archive-api.open-meteo.com/v1/archive"
-
     params = {
         "latitude": latitude,
         "longitude": longitude,
@@ -41,10 +47,10 @@ def fetch_weather_data_for_year(year: int, start_month: int = 1, end_month: int
     }
 
     try:
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
+        if end_date > date.today() - ARCHIVE_DELAY:
+            cache_folder = None
+        data = get_json(url, params=params, cache_folder=cache_folder, session=session)
+
         hourly = data.get("hourly", {})
 
         df = pl.DataFrame({
@@ -69,54 +75,98 @@ def fetch_weather_data_for_year(year: int, start_month: int = 1, end_month: int
 
 
 
-def decode_weather_code(code: int) -> str:
-    weather_codes = {
-        0: "Clear sky",
-        1: "Mainly clear",
-        2: "Partly cloudy",
-        3: "Overcast",
-        45: "Fog",
-        48: "Depositing rime fog",
-        51: "Drizzle: Light",
-        53: "Drizzle: Moderate",
-        55: "Drizzle: Dense",
-        56: "Freezing Drizzle: Light",
-        57: "Freezing Drizzle: Dense",
-        61: "Rain: Slight",
-        63: "Rain: Moderate",
-        65: "Rain: Heavy",
-        66: "Freezing Rain: Light",
-        67: "Freezing Rain: Heavy",
-        71: "Snowfall: Slight",
-        73: "Snowfall: Moderate",
-        75: "Snowfall: Heavy",
-        77: "Snow grains",
-        80: "Rain showers: Slight",
-        81: "Rain showers: Moderate",
-        82: "Rain showers: Violent",
-        85: "Snow showers: Slight",
-        86: "Snow showers: Heavy",
-        95: "Thunderstorm: Moderate",
-        96: "Thunderstorm: Light hail",
-        99: "Thunderstorm: Heavy hail"
-    }
-    return weather_codes.get(code, f"Unknown ({code})")
+WEATHER_CODES = {
+    0: "Clear sky",
+    1: "Mainly clear",
+    2: "Partly cloudy",
+    3: "Overcast",
+    45: "Fog",
+    48: "Depositing rime fog",
+    51: "Drizzle: Light",
+    53: "Drizzle: Moderate",
+    55: "Drizzle: Dense",
+    56: "Freezing Drizzle: Light",
+    57: "Freezing Drizzle: Dense",
+    61: "Rain: Slight",
+    63: "Rain: Moderate",
+    65: "Rain: Heavy",
+    66: "Freezing Rain: Light",
+    67: "Freezing Rain: Heavy",
+    71: "Snowfall: Slight",
+    73: "Snowfall: Moderate",
+    75: "Snowfall: Heavy",
+    77: "Snow grains",
+    80: "Rain showers: Slight",
+    81: "Rain showers: Moderate",
+    82: "Rain showers: Violent",
+    85: "Snow showers: Slight",
+    86: "Snow showers: Heavy",
+    95: "Thunderstorm: Moderate",
+    96: "Thunderstorm: Light hail",
+    99: "Thunderstorm: Heavy hail"
+}
+
+WEATHER_CODE_TABLE = pl.DataFrame(
+    {"weather_code": list(WEATHER_CODES), "weather_description": list(WEATHER_CODES.values())},
+    schema={"weather_code": pl.Int64, "weather_description": pl.String},
+)
 
 
-
-if __name__ == "__main__":
+def decode_weather_code(code: int) -> str:
+    return WEATHER_CODES.get(code, f"Unknown ({code})")
+
+
+def decode_weather_codes(df: pl.DataFrame, column: str = "weather_code") -> pl.DataFrame:
+    """
+    Adds the weather_description of every code as one lookup join (null codes stay null).
+    Same text as decode_weather_code on the values of the column, e.g. "Unknown (4.0)" for a float column.
+    """
+    code = pl.col(column)
+    codes = WEATHER_CODE_TABLE.rename({"weather_code": "_code"})
+    return (
+        df
+        # only whole numbers are in the table (4.0 == 4 for the dict of decode_weather_code)
+        .with_columns(pl.when(code == code.round()).then(code.cast(pl.Int64)).alias("_code"))
+        .join(codes, on="_code", how="left", maintain_order="left")
+        .with_columns(
+            pl.coalesce(
+                pl.col("weather_description"),
+                pl.format("Unknown ({})", code),
+            ).alias("weather_description")
+        )
+        .drop("_code")
+    )
+
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--start_year", default=2013, type=int)
     parser.add_argument("--end_year", default=2025, type=int)
     parser.add_argument("--folder", default="data/", type=str)
+    parser.add_argument("--workers", default=4, type=int, help="Number of years fetched concurrently.")
+    parser.add_argument("--cache-folder", default=CACHE_FOLDER, type=str, help="On-disk cache for the API responses.")
+    parser.add_argument("--no-cache", default=False, action="store_true", help="Always query the API.")
+    parser.add_argument("--url", default=ARCHIVE_URL, type=str, help="Archive API endpoint (e.g. a local stand-in).")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     out_folder = os.path.join(args.folder, "processed", "weather")
     Path(out_folder).mkdir(parents=True, exist_ok=True)
 
-    for year in tqdm(range(args.start_year, args.end_year), desc="Downloading weather data"):
-        df = fetch_weather_data_for_year(year)
+    cache_folder = None if args.no_cache else args.cache_folder
+    years = list(range(args.start_year, args.end_year))
+
+    def run(session, year):
+        df = fetch_weather_data_for_year(year, cache_folder=cache_folder, url=args.url, session=session)
+        return {"year": year, "df": df, "error": None if df is not None else "request failed"}
+
+    start = time.perf_counter()
+    results = run_pool(run, [(year,) for year in years], args.workers, desc="Downloading weather data")
+    print(f"Fetched {sum(r['error'] is None for r in results)}/{len(years)} years in {time.perf_counter() - start:.1f}s")
+
+    for result in results:
+        year, df = result["year"], result["df"]
 
         if df is None or len(df) == 0:
             print(f"No data for {year}")
@@ -135,9 +185,11 @@ if __name__ == "__main__":
             pl.col("datetime").dt.ordinal_day().alias("day_of_year"),
         ])
 
-        df = df.with_columns([
-            pl.col("weather_code").map_elements(decode_weather_code, return_dtype=pl.String).alias("weather_description")
-        ])
+        df = decode_weather_codes(df)
 
         outfile = os.path.join(out_folder, f"weather_{year}.csv")
         df.write_csv(outfile)
+
+
+if __name__ == "__main__":
+    main()
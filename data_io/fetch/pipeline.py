@@ -0,0 +1,203 @@
+# small in-process dependency graph for the fetch / process stages, see fetch_all.py
+import os
+import glob
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import polars as pl
+
+
+class Stage:
+    """
+    One step of the pipeline, run() writes the files matching the output globs.
+    inputs are globs of files the outputs are derived from (e.g. the code of the stage), the outputs of
+    the dependencies (deps) count as inputs as well. params describe the configuration of the stage,
+    a stage is run again if they changed since its last successful run.
+    """
+
+    def __init__(self, name, run, outputs, inputs=(), deps=(), params=None):
+        self.name = name
+        self.run = run
+        self.outputs = list(outputs)
+        self.inputs = list(inputs)
+        self.deps = list(deps)
+        self.params = params
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={self.deps})"
+
+    def output_files(self):
+        return sorted({f for pattern in self.outputs for f in glob.glob(pattern, recursive=True) if os.path.isfile(f)})
+
+    def input_files(self, stages):
+        files = {f for pattern in self.inputs for f in glob.glob(pattern, recursive=True) if os.path.isfile(f)}
+        for dep in self.deps:
+            files.update(stages[dep].output_files())
+        return sorted(files)
+
+
+def count_rows(path):
+    if path.endswith(".parquet"):
+        return pl.scan_parquet(path).select(pl.len()).collect().item()
+    if path.endswith(".csv"):
+        return pl.scan_csv(path, infer_schema=False).select(pl.len()).collect().item()
+    return None
+
+
+def output_stats(files, rows=True):
+    stats = {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files), "rows": None}
+    if rows:
+        counts = [count_rows(f) for f in files]
+        stats["rows"] = sum(c for c in counts if c is not None)
+    return stats
+
+
+def is_fresh(stage, stages, state, max_age=None):
+    """
+    True if the stage has outputs, all of them are newer than its inputs, its params did not change
+    and (with max_age in seconds) the newest output is younger than max_age.
+    """
+    outputs = stage.output_files()
+    if not outputs:
+        return False
+
+    if state.get(stage.name, {}).get("params") != stage.params:
+        return False
+
+    mtimes = [os.path.getmtime(f) for f in outputs]
+    if max_age is not None and time.time() - max(mtimes) > max_age:
+        return False
+
+    inputs = stage.input_files(stages)
+    return not inputs or min(mtimes) >= max(os.path.getmtime(f) for f in inputs)
+
+
+def _load_state(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _select(stages, only):
+    # the selected stages and everything they depend on
+    selected = set()
+    todo = list(only)
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise KeyError(f"Unknown stage: {name}")
+        if name not in selected:
+            selected.add(name)
+            todo.extend(stages[name].deps)
+    return selected
+
+
+def run_pipeline(stages, workers=4, force=False, only=None, max_age=None, log_path=None, state_path=None):
+    """
+    Runs the stages in dependency order, independent stages concurrently on `workers` threads.
+    Stages that are fresh (see is_fresh) are skipped unless force is set, stages whose dependency failed
+    are not run. Every stage appends one record (status, wall time, files, bytes, rows) to log_path (json lines).
+    Returns the records as a DataFrame.
+    """
+    stages = {stage.name: stage for stage in stages}
+    for stage in stages.values():
+        for dep in stage.deps:
+            if dep not in stages:
+                raise KeyError(f"{stage.name} depends on unknown stage {dep}")
+
+    selected = _select(stages, only) if only else set(stages)
+    state = _load_state(state_path)
+    run_id = uuid.uuid4().hex[:8]
+
+    def new_record(name, status=None):
+        return {
+            "run": run_id,
+            "stage": name,
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "status": status,
+            "seconds": 0.0,
+            "files": None,
+            "bytes": None,
+            "rows": None,
+            "error": None,
+        }
+
+    def log(record):
+        if log_path is not None:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            with open(log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def execute(stage):
+        record = new_record(stage.name)
+        start = time.perf_counter()
+
+        if not force and is_fresh(stage, stages, state, max_age=max_age):
+            record["status"] = "skipped"
+            record.update(output_stats(stage.output_files(), rows=False))
+        else:
+            try:
+                stage.run()
+                record["status"] = "ok"
+            except (Exception, SystemExit) as e:
+                record["status"] = "failed"
+                record["error"] = f"{type(e).__name__}: {e}"
+
+            outputs = stage.output_files()
+            # the fetch scripts report most errors by printing them, no outputs at all means the stage failed
+            if record["status"] == "ok" and not outputs:
+                record["status"] = "failed"
+                record["error"] = "no outputs written"
+
+            record.update(output_stats(outputs, rows=record["status"] == "ok"))
+
+        record["seconds"] = time.perf_counter() - start
+        return record
+
+    records = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while len(records) < len(selected):
+            for name in sorted(selected):
+                if name in records or name in running.values():
+                    continue
+
+                deps = [records.get(dep) for dep in stages[name].deps]
+                if any(r is not None and r["status"] in ("failed", "blocked") for r in deps):
+                    records[name] = new_record(name, "blocked")
+                    records[name]["error"] = "a dependency failed"
+                    log(records[name])
+                elif all(r is not None for r in deps):
+                    running[pool.submit(execute, stages[name])] = name
+
+            if not running:
+                if len(records) < len(selected):
+                    raise ValueError(f"Cyclic dependencies between {sorted(selected - set(records))}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                records[running.pop(future)] = record
+                log(record)
+
+                if record["status"] == "ok":
+                    state[record["stage"]] = {"params": stages[record["stage"]].params, "finished": record["started"]}
+                    if state_path is not None:
+                        _save_state(state_path, state)
+
+    return pl.DataFrame([records[name] for name in sorted(records, key=lambda n: records[n]["started"])])
@@ -30,10 +30,10 @@ class AccidentData(BaseData):
         return df
     
     def bicycle_only(self):
-        return AccidentData(self.df.filter(pl.col("is_bicycle") == 1))
+        return AccidentData(self._frame.filter(pl.col("is_bicycle") == 1))
 
     def filter_region(self, state=None, region=None, district=None):
-        df = self.df
+        df = self._frame
 
         if state is not None:
             df = df.filter(pl.col("state") == state)
@@ -1,25 +1,87 @@
+import numpy as np
 import polars as pl
 from datetime import datetime, timezone
+from data_io.loader.intervals import IntervalSet
+
+_UNITS_PER_SECOND = {"ns": 1_000_000_000, "us": 1_000_000, "ms": 1_000}
 
 class BaseData:
-    def __init__(self, df: pl.DataFrame):
-        self.df = df
+    """
+    Wraps either an eager pl.DataFrame or a pl.LazyFrame.
+    In lazy mode all operations only extend the query plan, it is collected once on access of .df
+    """
+
+    def __init__(self, df: pl.DataFrame | pl.LazyFrame):
+        self._frame = df
+
+    @property
+    def df(self) -> pl.DataFrame:
+        if isinstance(self._frame, pl.LazyFrame):
+            self._frame = self._frame.collect()
+        return self._frame
+
+    @df.setter
+    def df(self, df: pl.DataFrame | pl.LazyFrame):
+        self._frame = df
+
+    @property
+    def is_lazy(self):
+        return isinstance(self._frame, pl.LazyFrame)
+
+    def lazy(self):
+        return self.new(self._frame.lazy())
+
+    def collect(self):
+        return self.new(self.df)
+
+    @property
+    def columns(self):
+        return self._frame.collect_schema().names()
+
+    def _item(self, expr):
+        df = self._frame.select(expr)
+        if isinstance(df, pl.LazyFrame):
+            df = df.collect()
+        return df.item()
 
     def new(self, df):
         return self.__class__(df)
 
     def drop(self, columns: list[str]):
-        df = self.df.drop(columns)
+        df = self._frame.drop(columns)
         return self.new(df)
 
-    def interval(self, start: str, end: str):
+    @staticmethod
+    def _bounds(start: str, end: str):
         start_dt = datetime.strptime(start, "%Y-%m-%d").replace(tzinfo=timezone.utc)
         end_dt = datetime.strptime(end, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-
-        df = self.df.filter(
+        return start_dt, end_dt
+
+    @staticmethod
+    def _interval_frame(df, start_dt, end_dt):
+        # time ordered frames are sliced with a binary search (zero-copy), everything else is filtered
+        if isinstance(df, pl.DataFrame):
+            dt = df["datetime"]
+            if (
+                isinstance(dt.dtype, pl.Datetime)
+                and dt.dtype.time_zone is not None
+                and dt.flags["SORTED_ASC"]
+                and dt.null_count() == 0
+            ):
+                # search directly on the physical epoch values, bounds are whole seconds
+                scale = _UNITS_PER_SECOND[dt.dtype.time_unit]
+                bounds = [int(start_dt.timestamp()) * scale, int(end_dt.timestamp()) * scale]
+                lo, hi = np.searchsorted(dt.to_physical().to_numpy(), bounds, side="left")
+                return df.slice(int(lo), int(hi - lo))
+
+        return df.filter(
             (pl.col("datetime") >= start_dt) &
             (pl.col("datetime") < end_dt)
         )
+
+    def interval(self, start: str, end: str):
+        start_dt, end_dt = self._bounds(start, end)
+        df = self._interval_frame(self._frame, start_dt, end_dt)
         return self.new(df)
     
 
@@ -28,7 +90,7 @@ class BaseData:
         weekday = None,   # True=Mo–Fr, False=Sa–So
         time_frame = (0, 24)
     ):
-        df = self.df
+        df = self._frame
         hour_min, hour_max = time_frame
 
         if weekday is not None:
@@ -46,18 +108,19 @@ class BaseData:
     
     
     def filter_intervals(self, intervals, negate=False):
-        df = self.df
+        """
+        Keeps the rows whose date lies in one of the (start, end) intervals (both inclusive),
+        or outside of all of them with negate=True. intervals may be a list or an IntervalSet.
+        """
+        df = self._frame
 
         if not intervals:
             return self.new(df)
 
-        expr = None
-        for start, end in intervals:
-            cond = (
-                (pl.col("datetime").dt.date() >= pl.lit(start).cast(pl.Date)) &
-                (pl.col("datetime").dt.date() <= pl.lit(end).cast(pl.Date))
-            )
-            expr = cond if expr is None else expr | cond
+        if not isinstance(intervals, IntervalSet):
+            intervals = IntervalSet(intervals)
+
+        expr = intervals.contains_expr("datetime")
 
         if negate:
             expr = ~expr
@@ -66,10 +129,10 @@ class BaseData:
     
 
     def min_date(self):
-        return self.df.select(pl.col("datetime").min()).item()
+        return self._item(pl.col("datetime").min())
 
     def max_date(self):
-        return self.df.select(pl.col("datetime").max()).item()
+        return self._item(pl.col("datetime").max())
 
     def date_range(self, readable=False):
         if readable:
@@ -1,18 +1,65 @@
 from data_io.loader.base import BaseData
 import polars as pl
 
+# resolutions aggregated once when a station is loaded, resample() just looks them up
+ROLLUP_RATES = ("1h", "1d", "1mo")
+
+
 class BicycleData(BaseData):
-    def __init__(self, df: pl.DataFrame, station_name: str):
+    def __init__(self, df: pl.DataFrame, station_name: str, rollups=None):
         super().__init__(df)
         self.station = station_name
+        # rate -> already resampled pl.DataFrame of the same rows
+        self.rollups = rollups or {}
 
     def new(self, df):
         return BicycleData(df, self.station)
-    
-    def resample(self, rate: str):
-        df = (
-            self.df.sort("datetime")
-            .group_by_dynamic("datetime", every=rate)
+
+    def _with_rollups(self, df, rollups):
+        return BicycleData(df, self.station, rollups)
+
+    def lazy(self):
+        return self._with_rollups(self._frame.lazy(), self.rollups)
+
+    def collect(self):
+        return self._with_rollups(self.df, self.rollups)
+
+    def build_rollups(self, rates=ROLLUP_RATES):
+        rollups = {rate: self._resample_frame(self._frame.lazy(), rate).collect() for rate in rates}
+        return self._with_rollups(self._frame, rollups)
+
+    def drop(self, columns: list[str]):
+        df = self._frame.drop(columns)
+        rollups = {rate: level.drop(columns, strict=False) for rate, level in self.rollups.items()}
+        return self._with_rollups(df, rollups)
+
+    def cast(self, dtypes):
+        # same for the frame and every rollup level
+        df = self._frame.cast(dtypes, strict=False)
+        rollups = {rate: level.cast(dtypes, strict=False) for rate, level in self.rollups.items()}
+        return self._with_rollups(df, rollups)
+
+    def interval(self, start: str, end: str):
+        start_dt, end_dt = self._bounds(start, end)
+        df = self._interval_frame(self._frame, start_dt, end_dt)
+
+        # a level stays valid only if the bounds are on its bucket boundaries (e.g. first of month for "1mo")
+        bounds = pl.Series([start_dt, end_dt])
+        rollups = {
+            rate: self._interval_frame(level, start_dt, end_dt)
+            for rate, level in self.rollups.items()
+            if (bounds.dt.truncate(rate) == bounds).all()
+        }
+        return self._with_rollups(df, rollups)
+
+    @staticmethod
+    def _resample_frame(df, rate: str):
+        # the combined table of all stations (see DataLoader.get_bicycle_all) is resampled per station
+        by = "station" if "station" in df.collect_schema().names() else None
+
+        return (
+            df.sort(["station", "datetime"] if by else "datetime")
+            .group_by_dynamic("datetime", every=rate, group_by=by)
             .agg([
                 pl.col("channels_in").sum(),
                 pl.col("channels_out").sum(),
@@ -23,15 +70,24 @@ class BicycleData(BaseData):
                 pl.col("site_snow_accumulation").sum(),
             ])
         )
-        return BicycleData(df, self.station)    
-    
+
+    def resample(self, rate: str):
+        if rate in self.rollups:
+            level = self.rollups[rate]
+            return BicycleData(level.lazy() if self.is_lazy else level, self.station)
+
+        df = self._resample_frame(self._frame, rate)
+        return BicycleData(df, self.station)
+
+    def filter_stations(self, stations):
+        df = self._frame.filter(pl.col("station").cast(pl.String).is_in(stations))
+        return self.new(df)
+
     def min_count(self, column="channels_all"):
-        return self.df.select(pl.col(column).min()).item()
+        return self._item(pl.col(column).min())
 
     def max_count(self, column="channels_all"):
-        return self.df.select(pl.col(column).max()).item()
+        return self._item(pl.col(column).max())
 
     def count_range(self, column="channels_all"):
         return self.min_count(column), self.max_count(column)
-
-
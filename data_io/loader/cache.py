@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import polars as pl
+
+# bump this whenever the parsing of the source files changes, old cache files are rebuilt then
+CACHE_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParquetCache:
+    """
+    Keeps a parsed Parquet copy of every source csv file below cache_folder.
+    The copy is rebuilt only if the mtime and the content hash of the source file changed.
+    """
+
+    def __init__(self, source_folder="./data/processed/", cache_folder="./data/cache/"):
+        self.source_folder = source_folder
+        self.cache_folder = cache_folder
+
+    def _target(self, source):
+        rel = os.path.relpath(source, self.source_folder)
+        return os.path.join(self.cache_folder, os.path.splitext(rel)[0] + ".parquet")
+
+    def _read_meta(self, meta_path):
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta_path, stat, digest):
+        meta = {
+            "version": CACHE_VERSION,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+
+    def is_valid(self, source):
+        target = self._target(source)
+        meta_path = target + ".json"
+        meta = self._read_meta(meta_path)
+
+        if meta is None or meta.get("version") != CACHE_VERSION or not os.path.exists(target):
+            return False
+
+        stat = os.stat(source)
+        if meta["mtime"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            return True
+
+        # mtime changed (e.g. file was copied or re-fetched), check if the content changed as well
+        if meta["size"] == stat.st_size and meta["sha256"] == file_hash(source):
+            self._write_meta(meta_path, stat, meta["sha256"])
+            return True
+
+        return False
+
+    def load(self, source, reader):
+        """
+        Returns reader(source), read from the cached Parquet file if it is still valid.
+        """
+        target = self._target(source)
+
+        if self.is_valid(source):
+            return pl.read_parquet(target)
+
+        stat = os.stat(source)
+        df = reader(source)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        df.write_parquet(target)
+        self._write_meta(target + ".json", stat, file_hash(source))
+
+        return df
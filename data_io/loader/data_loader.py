@@ -1,5 +1,8 @@
 import os
+import json
+import time
 import polars as pl
+from concurrent.futures import ThreadPoolExecutor
 from data_io.formats.formats import (
     ACCIDENT_FORMAT,
     WEATHER_FORMAT,
@@ -10,27 +13,291 @@ from data_io.loader.bicycle import BicycleData
 from data_io.loader.weather import WeatherData
 from data_io.loader.accident import AccidentData
 from data_io.loader.holidays import HolidaysData
+from data_io.loader.cache import ParquetCache
+from data_io.loader.lru import LRUCache
+from data_io.loader.manifest import DatasetManifest
+
+# constant per station, moved into DataLoader.station_meta when a station is loaded
+BICYCLE_META_COLUMNS = [
+    "operator_name",
+    "domain_name",
+    "domain_id",
+    "counter_site_id",
+    "counter_site",
+    "counter_serial",
+    "timezone",
+    "iso_timestamp",
+    "longitude",
+    "latitude",
+]
+
+BICYCLE_COUNT_COLUMNS = ["channels_in", "channels_out", "channels_all", "channels_unknown"]
+
+# dtypes of the counts in the frames handed out by get_bicycle / get_bicycle_all
+BICYCLE_COUNT_DTYPES = {col: BICYCLE_FORMAT[col] for col in BICYCLE_COUNT_COLUMNS}
+
+# (dtype, min, max), smallest first. No 8 bit types: the stored counts are only cast back to
+# BICYCLE_COUNT_DTYPES when handed out, anything computed on them before must not wrap around
+_UNSIGNED = [(pl.UInt16, 0, 2**16 - 1), (pl.UInt32, 0, 2**32 - 1)]
+_SIGNED = [(pl.Int16, -(2**15), 2**15 - 1), (pl.Int32, -(2**31), 2**31 - 1)]
+
+
+def _smallest_int_type(lo, hi):
+    if lo is None:
+        return pl.UInt16
+    for dtype, dtype_min, dtype_max in _UNSIGNED if lo >= 0 else _SIGNED:
+        if dtype_min <= lo and hi <= dtype_max:
+            return dtype
+    return pl.Int64
+
+
+def compact_counts(df):
+    """
+    Stores the counts in the smallest fitting integer type (at least 16 bit)
+    """
+    return df.with_columns(
+        pl.col(col).cast(_smallest_int_type(df[col].min(), df[col].max()))
+        for col in BICYCLE_COUNT_COLUMNS
+    )
+
+
+def compact_station(df):
+    """
+    Drops the per station constants and compacts the counts (see compact_counts),
+    remaining strings become Categorical.
+    """
+    df = compact_counts(df.drop(BICYCLE_META_COLUMNS, strict=False))
+    return df.with_columns(
+        pl.col(col).cast(pl.Categorical)
+        for col, dtype in df.schema.items()
+        if dtype == pl.String
+    )
+
+
+def held_bytes(bd):
+    # frame and rollup levels of a BicycleData
+    return bd.df.estimated_size() + sum(level.estimated_size() for level in bd.rollups.values())
+
+
+def read_weather_csv(path):
+    df = pl.read_csv(path, schema=WEATHER_FORMAT)
+
+    if df.schema["datetime"] == pl.String:
+        df = df.with_columns(
+            pl.col("datetime")
+            .str.strptime(pl.Datetime, strict=False)
+            .dt.replace_time_zone("UTC")
+        )
+    return df
+
+
+def read_bicycle_csv(path):
+    df = pl.read_csv(path, schema=BICYCLE_FORMAT)
+
+    df = df.with_columns(
+        pl.col("iso_timestamp")
+        .str.strptime(pl.Datetime, format="%Y-%m-%dT%H:%M:%S%z", strict=False)
+        .alias("datetime")
+    )
+    return df
+
+
+def read_accident_csv(path):
+    return _accident_datetime(pl.read_csv(path, schema=ACCIDENT_FORMAT))
+
+
+def read_accident_parquet(path):
+    # written typed by fetch_accident_data.py
+    return _accident_datetime(pl.read_parquet(path, columns=list(ACCIDENT_FORMAT)))
+
+
+def _accident_datetime(df):
+    # The dataset does not specify which exact day of the month => day is unknown
+    # Set the day to 1 for each entry
+    df = df.with_columns(
+        [
+            pl.datetime(
+                pl.col("year"),
+                pl.col("month"),
+                1,  # Day unknown => set to 1
+                pl.col("hour"),
+            ).alias("datetime")
+        ]
+    )
+    return df
+
+
+def read_holidays_csv(path):
+    df = pl.read_csv(path, schema=HOLIDAYS_FORMAT).drop(["id", "type"])
+    df = df.with_columns(
+        [
+            pl.col("start_date")
+            .str.strptime(pl.Date, "%Y-%m-%d")
+            .alias("start_date"),
+            pl.col("end_date")
+            .str.strptime(pl.Date, "%Y-%m-%d")
+            .alias("end_date"),
+        ]
+    )
+    return df
 
 
 class DataLoader:
-    def __init__(self, city="Stadt_Heidelberg"):
+    def __init__(
+        self,
+        city="Stadt_Heidelberg",
+        use_cache=True,
+        cache_folder="./data/cache/",
+        memo_size=256,
+        memo_max_bytes=None,
+        workers=None,
+    ):
         self.city = city
 
+        # files of one dataset are read concurrently, polars releases the GIL while parsing
+        self.workers = workers if workers is not None else min(8, os.cpu_count() or 1)
+        # path -> {"seconds": ..., "rows": ...} of every file read so far
+        self.load_times = {}
+
         self.bicycle_folder = f"./data/processed/cycle_counter/{city}/"
         self.weather_folder = f"./data/processed/weather/"
         self.accident_folder = f"./data/processed/accidents/"
         self.holidays_folder = f"./data/processed/holidays/"
 
-        self.bicycle_data = {}
-        self.weather_data = None
-        self.accident_data = None
-        self.holidays_data = None
+        # parsed csv files are cached as parquet, see data_io/loader/cache.py
+        self.cache = ParquetCache("./data/processed/", cache_folder) if use_cache else None
+
+        self.cache_folder = cache_folder
+
+        # Data is loaded on first access (see the properties below) and kept in memory afterwards
+        self._bicycle_data = {}
+        self._weather_data = None
+        self._accident_data = None
+        self._holidays_data = None
+        self._loaded = set()
+        self._stations = None
+        self._bicycle_all = None
+        # station -> estimated bytes of the parsed frame and of the compact one
+        self._station_bytes = {}
+
+        # results of get_bicycle / get_bicycle_all keyed on (station, interval, sample_rate)
+        self._memo = LRUCache(maxsize=memo_size, max_bytes=memo_max_bytes)
+
+        # hashes, rows and date ranges of data/processed/, checked when the first dataset is loaded
+        self.processed_folder = "./data/processed/"
+        self._manifest = None
+        self._checked = False
+
+    def _ensure(self, name, load):
+        if name not in self._loaded:
+            self._loaded.add(name)
+            self._check_dataset()
+            load()
+
+    def _check_dataset(self):
+        """
+        Compares size and mtime of the processed files with the manifest written by fetch_all (if there is one),
+        changed files are hashed again and reported. Runs once, before the first file is read.
+        """
+        if self._checked:
+            return
+        self._checked = True
+
+        manifest = DatasetManifest(self.processed_folder)
+        if not os.path.exists(manifest.path):
+            # not fetched with fetch_all, dataset_version hashes everything on first use
+            return
+
+        self._manifest = manifest
+        if manifest.stale_files():
+            diff = manifest.update()
+            changes = ", ".join(f"{len(files)} {kind}" for kind, files in diff.items() if files)
+            if changes:
+                print(f"data/processed changed since the manifest was written ({changes}), dataset version {manifest.version}")
+
+    @property
+    def bicycle_data(self):
+        # all stations, only needed if someone iterates over the raw dict
+        self._load_stations(self.get_bicyle_stations())
+        return self._bicycle_data
+
+    @property
+    def weather_data(self):
+        self._ensure("weather", self._load_weather)
+        return self._weather_data
+
+    @property
+    def accident_data(self):
+        self._ensure("accidents", self._load_accidents)
+        return self._accident_data
+
+    @property
+    def holidays_data(self):
+        self._ensure("holidays", self._load_holidays)
+        return self._holidays_data
+
+    def _read(self, path, reader):
+        if self.cache is None:
+            return reader(path)
+        return self.cache.load(path, reader)
+
+    def _load_parallel(self, paths, load):
+        """
+        Runs load(path) for all paths on a thread pool and returns the results in the order of paths.
+        """
+        def timed(path):
+            start = time.perf_counter()
+            out = load(path)
+            return out, time.perf_counter() - start
+
+        if self.workers > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(timed, paths))
+        else:
+            results = [timed(path) for path in paths]
+
+        for path, (out, seconds) in zip(paths, results):
+            df = out.df if hasattr(out, "df") else out
+            self.load_times[path] = {"seconds": seconds, "rows": df.height}
+
+        return [out for out, _ in results]
+
+    def load_report(self):
+        """
+        Load time and number of rows of every file read so far, slowest first
+        """
+        return pl.DataFrame(
+            [{"file": path, **info} for path, info in self.load_times.items()],
+            schema={"file": pl.String, "seconds": pl.Float64, "rows": pl.Int64},
+        ).sort("seconds", descending=True)
+
+    def verify_dataset(self):
+        """
+        Checks the processed files against data/processed/manifest.json (written by fetch_all) and updates it,
+        only files whose size or mtime changed are hashed again.
+        Returns the added / changed / removed files.
+        """
+        if self._manifest is None:
+            self._manifest = DatasetManifest(self.processed_folder)
+        return self._manifest.update()
+
+    @property
+    def dataset_version(self):
+        """
+        Hash over the content of all processed files, use it as part of the keys of anything
+        computed from the data (feature tables, clusterings, figures).
+        """
+        if self._manifest is None:
+            self.verify_dataset()
+        return self._manifest.version
 
-        # This will trigger data loading
-        self._load_bicycle()
-        self._load_weather()
-        self._load_accidents()
-        self._load_holidays()
+    def dataset_summary(self):
+        """
+        Files, rows, bytes and date range per source from the dataset manifest
+        """
+        if self._manifest is None:
+            self.verify_dataset()
+        return self._manifest.summary()
 
     def _load_weather(self):
         if not os.path.exists(self.weather_folder):
@@ -43,28 +310,18 @@ class DataLoader:
             print("No weather csv files found")
             return
 
-        dfs = []
-
-        for file in files:
-            path = os.path.join(self.weather_folder, file)
-            df = pl.read_csv(path, schema=WEATHER_FORMAT)
-
-            if df.schema["datetime"] == pl.String:
-                df = df.with_columns(
-                    pl.col("datetime")
-                    .str.strptime(pl.Datetime, strict=False)
-                    .dt.replace_time_zone("UTC")
-                )
-
-            dfs.append(df)
+        paths = [os.path.join(self.weather_folder, file) for file in files]
+        dfs = self._load_parallel(paths, lambda path: self._read(path, read_weather_csv))
 
         # combine all weather files
         full_df = pl.concat(dfs).sort("datetime")
 
-        self.weather_data = WeatherData(full_df)
+        self._weather_data = WeatherData(full_df)
 
-    def get_weather(self, interval=None, sample_rate=None):
+    def get_weather(self, interval=None, sample_rate=None, lazy=False):
         wd = self.weather_data
+        if lazy:
+            wd = wd.lazy()
 
         # datetime already includes all of this information
         wd = wd.drop(
@@ -96,62 +353,249 @@ class DataLoader:
 
         return merged
 
-    def _load_bicycle(self):
+    def _read_station_info(self, path):
+        # only the first row is parsed, name, location etc. are constant per station file
+        row = pl.read_csv(path, schema=BICYCLE_FORMAT, n_rows=1).row(0, named=True)
+        return {
+            "station": row["counter_site"],
+            "latitude": row["latitude"],
+            "longitude": row["longitude"],
+            "meta": {
+                col: row[col] for col in BICYCLE_META_COLUMNS if col != "iso_timestamp"
+            },
+        }
+
+    def _load_station_manifest(self):
+        """
+        Maps the readable station names to their csv files without parsing the full files.
+        The result is stored as a small manifest next to the parquet cache.
+        """
+        self._check_dataset()
         files = os.listdir(self.bicycle_folder)
         self.csv_files = [f for f in files if f.endswith(".csv")]
 
+        manifest_path = None
+        manifest = {}
+        if self.cache is not None:
+            manifest_path = os.path.join(
+                self.cache_folder, "cycle_counter", self.city, "stations.json"
+            )
+            if os.path.exists(manifest_path):
+                try:
+                    with open(manifest_path, "r") as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    manifest = {}
+
+        changed = False
+        entries = {}
         for file in self.csv_files:
             path = os.path.join(self.bicycle_folder, file)
+            stat = os.stat(path)
+
+            entry = manifest.get(file)
+            if (
+                entry is None
+                or "meta" not in entry
+                or entry["mtime"] != stat.st_mtime_ns
+                or entry["size"] != stat.st_size
+            ):
+                entry = self._read_station_info(path)
+                entry.update({"mtime": stat.st_mtime_ns, "size": stat.st_size})
+                changed = True
+
+            entries[file] = entry
+
+        if manifest_path is not None and (changed or set(entries) != set(manifest)):
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            with open(manifest_path, "w") as f:
+                json.dump(entries, f)
+
+        self._stations = {}
+        for file, entry in entries.items():
+            self._stations[entry["station"]] = {**entry, "file": file}
+
+    def _load_stations(self, station_names):
+        if self._stations is None:
+            self._load_station_manifest()
+
+        missing = [s for s in station_names if s not in self._bicycle_data]
+        paths = {
+            os.path.join(self.bicycle_folder, self._stations[s]["file"]): s for s in missing
+        }
+
+        def load(path):
+            # sorted => interval() can binary search instead of scanning every row
+            df = self._read(path, read_bicycle_csv).sort("datetime")
+            self._station_bytes[paths[path]] = df.estimated_size()
+
+            # BicycleData Objekt inkl. 1h/1d/1mo rollups, aggregated from the counts in BICYCLE_COUNT_DTYPES
+            rollups = BicycleData(df.drop(BICYCLE_META_COLUMNS, strict=False), paths[path]).build_rollups().rollups
+            rollups = {rate: compact_counts(level) for rate, level in rollups.items()}
+            return BicycleData(compact_station(df), paths[path], rollups)
+
+        for bd in self._load_parallel(list(paths), load):
+            self._bicycle_data[bd.station] = bd
+
+    def _get_station(self, station_name):
+        if station_name not in self._bicycle_data:
+            self._load_stations([station_name])
+
+        return self._bicycle_data[station_name]
 
-            df = pl.read_csv(path, schema=BICYCLE_FORMAT)
+    def get_bicyle_stations(self):
+        """
+        Returns a list of readable station names
+        """
+        if self._stations is None:
+            self._load_station_manifest()
+        return list(self._stations.keys())
 
-            df = df.with_columns(
-                pl.col("iso_timestamp")
-                .str.strptime(pl.Datetime, format="%Y-%m-%dT%H:%M:%S%z", strict=False)
-                .alias("datetime")
-            )
+    @property
+    def station_meta(self):
+        """
+        One row of constants (operator, domain, counter id and serial, timezone, location) per station
+        """
+        if self._stations is None:
+            self._load_station_manifest()
+        return pl.DataFrame(
+            [{"station": name, **entry["meta"]} for name, entry in self._stations.items()]
+        )
 
-            station_name = df["counter_site"][0]
+    def memory_report(self):
+        """
+        In-memory size per station as parsed from the csv (before) and after moving the constants
+        into station_meta and compacting the dtypes (after, rollups counted separately).
+        The results memoized by get_bicycle / get_bicycle_all are in cache_info()["bytes"].
+        """
+        self._load_stations(self.get_bicyle_stations())
+
+        rows = []
+        for station, bd in self._bicycle_data.items():
+            before = self._station_bytes[station]
+            after = bd.df.estimated_size()
+            rows.append({
+                "station": station,
+                "rows": bd.df.height,
+                "bytes_before": before,
+                "bytes_after": after,
+                "bytes_rollups": held_bytes(bd) - after,
+                "ratio": after / before if before else None,
+            })
+
+        return pl.DataFrame(rows).sort("station")
 
-            # BicycleData Objekt speichern
-            self.bicycle_data[station_name] = BicycleData(df, station_name)
+    def get_bicycle_location(self, station_name):
+        if self._stations is None:
+            self._load_station_manifest()
+        station = self._stations[station_name]
+        return station["latitude"], station["longitude"]
 
-    def get_bicyle_stations(self):
+    def get_bicycle(self, station_name, interval=None, sample_rate=None, lazy=False) -> BicycleData:
         """
-        Returns a list of readable station names
+        With lazy=True the returned BicycleData only holds a query plan,
+        further filters are pushed down and everything is collected once on .df
         """
-        return list(self.bicycle_data.keys())
+        key = ("bicycle", station_name, self._interval_key(interval), sample_rate)
 
-    def get_bicycle_location(self, station_name):
-        bd = self.bicycle_data[station_name]
-        lat, lon = bd.df.select(["latitude", "longitude"]).row(0)
-        return lat, lon
-
-    def get_bicycle(self, station_name, interval=None, sample_rate=None) -> BicycleData:
-        bd = self.bicycle_data[station_name]
-
-        bd = bd.drop(
-            [
-                "operator_name",
-                "domain_name",
-                "domain_id",
-                "counter_site_id",
-                "counter_site",
-                "counter_serial",
-                "timezone",
-                "iso_timestamp",
-                "longitude",
-                "latitude",
+        def build():
+            # eager on purpose: interval() slices the sorted station frame and resample() hits the rollups
+            bd = self._get_station(station_name)
+
+            if interval is not None:
+                bd = bd.interval(interval[0], interval[1])
+
+            if sample_rate is not None:
+                bd = bd.resample(sample_rate)
+
+            return bd
+
+        # memoized compact (see compact_station), handed out with the dtypes of BICYCLE_FORMAT
+        return self._memoized(key, build, lazy).cast(BICYCLE_COUNT_DTYPES)
+
+    @staticmethod
+    def _interval_key(interval):
+        return tuple(interval) if interval is not None else None
+
+    def _memoized(self, key, build, lazy):
+        bd = self._memo.get(key)
+        if bd is None:
+            bd = build()
+            self._memo.put(key, bd, held_bytes(bd))
+        return bd.lazy() if lazy else bd
+
+    def cache_info(self):
+        """
+        Hits, misses and size of the get_bicycle / get_bicycle_all memo
+        """
+        return self._memo.info()
+
+    def invalidate_cache(self, station_name=None):
+        """
+        Drops memoized results, either all of them or the ones of a single station
+        """
+        if station_name is None:
+            self._memo.invalidate()
+            return
+
+        self._memo.invalidate(
+            lambda key: key[0] == "bicycle_all" or key[1] == station_name
+        )
+
+    @property
+    def bicycle_all(self) -> BicycleData:
+        """
+        All stations in one long table, station is a Categorical column.
+        Sorted by station and datetime, the counts are compact (see compact_counts).
+        """
+        if self._bicycle_all is None:
+            self._load_stations(self.get_bicyle_stations())
+            frames = [
+                self._get_station(station)
+                .cast(BICYCLE_COUNT_DTYPES)
+                .df.with_columns(pl.lit(station).alias("station"))
+                for station in self.get_bicyle_stations()
             ]
+            df = (
+                pl.concat(frames, how="vertical_relaxed")
+                .sort(["station", "datetime"])
+                .with_columns(pl.col("station").cast(pl.Categorical))
+            )
+            df = df.select(["station", *[c for c in df.columns if c != "station"]])
+            # rollups aggregated from the counts in BICYCLE_COUNT_DTYPES, as for a single station
+            bd = BicycleData(df, None).build_rollups()
+            rollups = {rate: compact_counts(level) for rate, level in bd.rollups.items()}
+            self._bicycle_all = BicycleData(compact_counts(df), None, rollups)
+
+        return self._bicycle_all
+
+    def get_bicycle_all(self, interval=None, sample_rate=None, stations=None, lazy=False) -> BicycleData:
+        """
+        Same as get_bicycle, but for all stations (or the given ones) at once.
+        resample aggregates per station.
+        """
+        key = (
+            "bicycle_all",
+            tuple(stations) if stations is not None else None,
+            self._interval_key(interval),
+            sample_rate,
         )
 
-        if interval is not None:
-            bd = bd.interval(interval[0], interval[1])
+        def build():
+            bd = self.bicycle_all.lazy()
+
+            if stations is not None:
+                bd = bd.filter_stations(stations)
+
+            if interval is not None:
+                bd = bd.interval(interval[0], interval[1])
 
-        if sample_rate is not None:
-            bd = bd.resample(sample_rate)
+            if sample_rate is not None:
+                bd = bd.resample(sample_rate)
 
-        return bd
+            return bd.collect()
+
+        return self._memoized(key, build, lazy).cast(BICYCLE_COUNT_DTYPES)
 
     def get_bicycle_pandas(self, station_name, interval=None, sample_rate=None):
         """
@@ -165,40 +609,30 @@ class DataLoader:
             print(f"Accident folder not found: {self.accident_folder}")
             return
 
+        # typed parquet from fetch_accident_data.py, csv from older fetches
         files = sorted(
-            f for f in os.listdir(self.accident_folder) if f.endswith(".csv")
+            f for f in os.listdir(self.accident_folder) if f.endswith((".csv", ".parquet"))
         )
 
         if not files:
             print("No accident CSV files found.")
             return
 
-        dfs = []
+        def load(path):
+            if path.endswith(".parquet"):
+                return read_accident_parquet(path)
+            return self._read(path, read_accident_csv)
 
-        for file in files:
-            path = os.path.join(self.accident_folder, file)
-            df = pl.read_csv(path, schema=ACCIDENT_FORMAT)
-
-            # The dataset does not specify which exact day of the month => day is unknown
-            # Set the day to 1 for each entry
-            df = df.with_columns(
-                [
-                    pl.datetime(
-                        pl.col("year"),
-                        pl.col("month"),
-                        1,  # Day unknown => set to 1
-                        pl.col("hour"),
-                    ).alias("datetime")
-                ]
-            )
-
-            dfs.append(df)
+        paths = [os.path.join(self.accident_folder, file) for file in files]
+        dfs = self._load_parallel(paths, load)
 
         full_df = pl.concat(dfs).sort("datetime")
-        self.accident_data = AccidentData(full_df)
+        self._accident_data = AccidentData(full_df)
 
-    def get_accidents(self, interval=None, sample_rate=None):
+    def get_accidents(self, interval=None, sample_rate=None, lazy=False):
         ad = self.accident_data
+        if lazy:
+            ad = ad.lazy()
 
         if interval:
             ad = ad.interval(interval[0], interval[1])
@@ -230,19 +664,9 @@ class DataLoader:
             # print("Ja", file)
             if file.startswith("schulferien_holidays_bw"):
                 path = os.path.join(self.holidays_folder, file)
-                df = pl.read_csv(path, schema=HOLIDAYS_FORMAT).drop(["id", "type"])
-                df = df.with_columns(
-                    [
-                        pl.col("start_date")
-                        .str.strptime(pl.Date, "%Y-%m-%d")
-                        .alias("start_date"),
-                        pl.col("end_date")
-                        .str.strptime(pl.Date, "%Y-%m-%d")
-                        .alias("end_date"),
-                    ]
-                )
+                df = self._read(path, read_holidays_csv).sort("start_date")
 
-                self.holidays_data = HolidaysData(df)
+                self._holidays_data = HolidaysData(df)
                 break
 
     # get_school_holidays('2023-08-01', '2023-08-20')
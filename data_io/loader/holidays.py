@@ -15,13 +15,21 @@ class HolidaysData(BaseData):
         start_dt = datetime.strptime(start, "%Y-%m-%d").replace(tzinfo=timezone.utc)
         end_dt = datetime.strptime(end, "%Y-%m-%d").replace(tzinfo=timezone.utc)
 
-        df = self.df.filter(
+        df = self._frame
+
+        # sorted by start_date => only holidays before the binary searched end position can overlap
+        if isinstance(df, pl.DataFrame):
+            starts = df["start_date"]
+            if starts.flags["SORTED_ASC"] and starts.null_count() == 0:
+                df = df.slice(0, starts.search_sorted(end_dt.date(), side="right"))
+
+        df = df.filter(
             (pl.col("end_date") >= start_dt) & (pl.col("start_date") <= end_dt)
         ).sort("start_date", descending=False)
         return self.new(df)
 
     def drop(self, columns: list[str]):
-        df = self.df.drop(columns)
+        df = self._frame.drop(columns)
         return HolidaysData(df)
     
     def resample(self, rate: str):
@@ -0,0 +1,129 @@
+import numpy as np
+import polars as pl
+from datetime import date, datetime
+
+# polars stores pl.Date as days since 1970-01-01, we use the same representation
+_EPOCH = date(1970, 1, 1).toordinal()
+_MIN_DAY = date.min.toordinal() - _EPOCH
+_MAX_DAY = date.max.toordinal() - _EPOCH + 1
+
+
+def _to_day(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal() - _EPOCH
+
+
+def _to_date(day):
+    return date.fromordinal(int(day) + _EPOCH)
+
+
+def _merge(starts, ends):
+    """
+    Sorts half-open day ranges and merges overlapping or touching ones.
+    """
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order]
+    ends = np.maximum.accumulate(ends[order])
+
+    # a new range begins wherever the start lies behind everything seen so far
+    new = np.empty(len(starts), dtype=bool)
+    new[0] = True
+    new[1:] = starts[1:] > ends[:-1]
+
+    idx = np.flatnonzero(new)
+    last = np.append(idx[1:], len(starts)) - 1
+    return starts[idx], ends[last]
+
+
+class IntervalSet:
+    """
+    Set of dates given as (start, end) ranges, both ends inclusive like the intervals of
+    DataLoader.get_all_holiday_intervals or WeatherData.get_intervals.
+    Ranges are kept sorted and merged, membership is a binary search over the bounds.
+    """
+
+    def __init__(self, intervals=()):
+        bounds = [(_to_day(start), _to_day(end) + 1) for start, end in intervals]
+        bounds = [(s, e) for s, e in bounds if e > s]
+
+        starts = np.array([s for s, _ in bounds], dtype=np.int64)
+        ends = np.array([e for _, e in bounds], dtype=np.int64)
+        self.starts, self.ends = _merge(starts, ends)
+
+    @classmethod
+    def _from_bounds(cls, starts, ends):
+        out = cls()
+        out.starts, out.ends = _merge(np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64))
+        return out
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.ends, other.ends)
+
+    def __repr__(self):
+        return f"IntervalSet({self.to_list()})"
+
+    def to_list(self):
+        return [
+            (_to_date(s).isoformat(), _to_date(e - 1).isoformat())
+            for s, e in zip(self.starts, self.ends)
+        ]
+
+    def union(self, other):
+        if not isinstance(other, IntervalSet):
+            other = IntervalSet(other)
+        return self._from_bounds(
+            np.concatenate([self.starts, other.starts]),
+            np.concatenate([self.ends, other.ends]),
+        )
+
+    def complement(self):
+        starts = np.concatenate([[_MIN_DAY], self.ends])
+        ends = np.concatenate([self.starts, [_MAX_DAY]])
+        keep = ends > starts
+        return self._from_bounds(starts[keep], ends[keep])
+
+    def intersection(self, other):
+        if not isinstance(other, IntervalSet):
+            other = IntervalSet(other)
+        return self.complement().union(other.complement()).complement()
+
+    __or__ = union
+    __and__ = intersection
+    __invert__ = complement
+
+    def contains(self, days):
+        """
+        Boolean mask for an array of days since 1970-01-01.
+        """
+        days = np.asarray(days)
+        if len(self.starts) == 0:
+            return np.zeros(days.shape, dtype=bool)
+
+        idx = np.searchsorted(self.starts, days, side="right") - 1
+        return (idx >= 0) & (days < self.ends[np.maximum(idx, 0)])
+
+    def contains_expr(self, column="datetime"):
+        """
+        Polars expression that is True for every row whose date lies in the set (null stays null).
+        """
+        days = pl.col(column).dt.date()
+
+        mask = days.map_batches(
+            lambda s: pl.Series(self.contains(s.to_physical().fill_null(0).to_numpy())),
+            return_dtype=pl.Boolean,
+        )
+        return pl.when(days.is_null()).then(None).otherwise(mask)
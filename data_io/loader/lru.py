@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small least-recently-used cache with an upper bound on the number of entries
+    and (optionally) on the summed size of the entries in bytes.
+    """
+
+    def __init__(self, maxsize=128, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value, size=0):
+        if self.maxsize <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+
+        self._entries[key] = (value, size)
+        self._bytes += size
+
+        while len(self._entries) > self.maxsize or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        ):
+            _, (_, old_size) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+
+    def invalidate(self, predicate=None):
+        """
+        Removes all entries, or only those whose key matches predicate(key).
+        """
+        if predicate is None:
+            self._entries.clear()
+            self._bytes = 0
+            return
+
+        for key in [k for k in self._entries if predicate(k)]:
+            self._bytes -= self._entries.pop(key)[1]
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,212 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+import polars as pl
+from data_io.loader.cache import file_hash
+
+MANIFEST_VERSION = 2
+
+# derived data that is not read by the DataLoader (the station csv files are written from it)
+EXCLUDED_FOLDERS = {"cycle_counter_partitioned"}
+
+# per source (first folder below processed/): columns holding the dates of a row and their format (None: inferred).
+# They are parsed before min / max, the cycle counter timestamps have mixed UTC offsets
+DATE_COLUMNS = {
+    "cycle_counter": (["iso_timestamp"], "%Y-%m-%dT%H:%M:%S%z"),
+    "weather": (["datetime"], None),
+    "holidays": (["start_date", "end_date"], "%Y-%m-%d"),
+}
+
+
+def _scan(path):
+    if path.endswith(".parquet"):
+        return pl.scan_parquet(path)
+    # everything as string, the stats below do not need the parsed types
+    return pl.scan_csv(path, infer_schema=False)
+
+
+def file_stats(path, source):
+    """
+    Row count and first / last date of one source file (ISO strings, accidents only have year and month,
+    timestamps with an UTC offset are converted to UTC).
+    """
+    lf = _scan(path)
+    columns = lf.collect_schema().names()
+
+    if source == "accidents" and "year" in columns and "month" in columns:
+        month = pl.format(
+            "{}-{}",
+            pl.col("year").cast(pl.String),
+            pl.col("month").cast(pl.String).str.zfill(2),
+        )
+        dates = [month]
+        out = None
+    else:
+        names, fmt = DATE_COLUMNS.get(source, ([], None))
+        dates = [pl.col(c).cast(pl.String).str.to_datetime(fmt, strict=False) for c in names if c in columns]
+        # back to strings in the format of the file (in UTC)
+        out = fmt or "%Y-%m-%dT%H:%M:%S"
+
+    exprs = [pl.len().alias("rows")]
+    if dates:
+        first = pl.min_horizontal([d.min() for d in dates])
+        last = pl.max_horizontal([d.max() for d in dates])
+        if out is not None:
+            first, last = first.dt.strftime(out), last.dt.strftime(out)
+        exprs += [first.alias("min_date"), last.alias("max_date")]
+
+    stats = lf.select(exprs).collect().row(0, named=True)
+    return {
+        "rows": stats["rows"],
+        "min_date": stats.get("min_date"),
+        "max_date": stats.get("max_date"),
+    }
+
+
+class DatasetManifest:
+    """
+    Content hash, row count and date range of every csv / parquet file below root, stored in
+    root/manifest.json. version is a hash over all file hashes, it only changes if the content of the
+    processed data changed and can be used as part of the keys of downstream caches.
+    """
+
+    def __init__(self, root="./data/processed/", path=None):
+        self.root = root
+        self.path = path or os.path.join(root, "manifest.json")
+        self.files = {}
+        self.version = None
+        # True if refresh() changed anything that is not saved yet
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("manifest_version") == MANIFEST_VERSION:
+            self.files = data.get("files", {})
+            self.version = data.get("version")
+
+    def save(self):
+        data = {
+            "manifest_version": MANIFEST_VERSION,
+            "version": self.version,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "files": self.files,
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+        self.dirty = False
+
+    def source_files(self):
+        """
+        Paths of all data files below root, relative to root.
+        """
+        files = []
+        for folder, dirs, names in os.walk(self.root):
+            dirs[:] = sorted(d for d in dirs if d not in EXCLUDED_FOLDERS)
+            for name in sorted(names):
+                if name.endswith((".csv", ".parquet")):
+                    files.append(os.path.relpath(os.path.join(folder, name), self.root))
+        return files
+
+    def _version(self):
+        h = hashlib.sha256()
+        for rel in sorted(self.files):
+            h.update(f"{rel.replace(os.sep, '/')}\0{self.files[rel]['sha256']}\n".encode())
+        return h.hexdigest()[:16]
+
+    def stale_files(self):
+        """
+        Files that were added, removed or whose size or mtime changed since the last refresh (no hashing).
+        """
+        current = set(self.source_files())
+        stale = set(self.files) ^ current
+        for rel in current & set(self.files):
+            stat = os.stat(os.path.join(self.root, rel))
+            entry = self.files[rel]
+            if entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                stale.add(rel)
+        return sorted(stale)
+
+    def refresh(self):
+        """
+        Brings the manifest up to date with the files on disk. Only files whose size or mtime changed
+        are hashed again, row counts and date ranges are only recomputed if the content changed.
+        Returns {"added": [...], "changed": [...], "removed": [...]} (relative paths).
+        """
+        diff = {"added": [], "changed": [], "removed": []}
+        current = self.source_files()
+
+        for rel in sorted(set(self.files) - set(current)):
+            del self.files[rel]
+            diff["removed"].append(rel)
+            self.dirty = True
+
+        for rel in current:
+            path = os.path.join(self.root, rel)
+            stat = os.stat(path)
+            entry = self.files.get(rel)
+
+            if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                continue
+
+            self.dirty = True
+            digest = file_hash(path)
+            if entry is not None and entry["sha256"] == digest:
+                # touched or copied, same content
+                entry["mtime"] = stat.st_mtime_ns
+                continue
+
+            source = rel.replace(os.sep, "/").split("/")[0]
+            self.files[rel] = {
+                "source": source,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": digest,
+                **file_stats(path, source),
+            }
+            diff["added" if entry is None else "changed"].append(rel)
+
+        version = self._version()
+        if version != self.version:
+            self.version = version
+            self.dirty = True
+        return diff
+
+    def update(self):
+        """
+        refresh() and save the manifest if anything changed.
+        """
+        diff = self.refresh()
+        if self.dirty or not os.path.exists(self.path):
+            self.save()
+        return diff
+
+    def summary(self):
+        """
+        Files, rows, bytes and date range per source.
+        """
+        if not self.files:
+            return pl.DataFrame()
+
+        return (
+            pl.DataFrame([{"file": rel, **entry} for rel, entry in self.files.items()])
+            .group_by("source")
+            .agg(
+                pl.len().alias("files"),
+                pl.col("rows").sum(),
+                pl.col("size").sum().alias("bytes"),
+                pl.col("min_date").min(),
+                pl.col("max_date").max(),
+            )
+            .sort("source")
+        )
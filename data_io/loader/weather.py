@@ -1,4 +1,5 @@
 from data_io.loader.base import BaseData
+from data_io.loader.intervals import IntervalSet
 import polars as pl
 
 class WeatherData(BaseData):
@@ -7,7 +8,7 @@ class WeatherData(BaseData):
     
     def resample(self, rate: str):
         df = (
-            self.df.sort("datetime")
+            self._frame.sort("datetime")
             .group_by_dynamic("datetime", every=rate)
             .agg([
                 pl.col("temperature_2m").mean(),
@@ -34,20 +35,7 @@ class WeatherData(BaseData):
             .sort("date")
         )
 
-        dates = df["date"].to_list()
-        if not dates:
-            return []
-
-        intervals = []
-        start = prev = dates[0]
-
-        for d in dates[1:]:
-            if (d - prev).days == 1:
-                prev = d
-            else:
-                intervals.append((start.isoformat(), prev.isoformat()))
-                start = prev = d
-
-        intervals.append((start.isoformat(), prev.isoformat()))
-        return intervals
+        # consecutive days are merged into one interval
+        days = df["date"].to_physical().to_numpy()
+        return IntervalSet._from_bounds(days, days + 1).to_list()
     
\ No newline at end of file
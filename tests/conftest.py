@@ -0,0 +1,117 @@
+# local stand-in for the download servers (mobidata, Unfallatlas, Open-Meteo), see the --base-url / --url options
+import hashlib
+import socket
+import threading
+import email.utils
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+
+class StandIn:
+    """
+    Serves the files put() into it under /<name> (the query string is ignored), with ETag, Last-Modified,
+    Content-Length, HEAD and Range / If-Range. cut[name] closes the connection of the next GET after that many
+    bytes of the body, fail[name] is a list of status codes answered (in order) before the file is served.
+    Every request is logged as (method, name, headers).
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.modified = {}
+        self.cut = {}
+        self.fail = {}
+        self.requests = []
+        self.url = None
+        self._version = 0
+
+    def put(self, name, data):
+        # Last-Modified only has seconds, a counter keeps the versions apart
+        self._version += 1
+        self.files[name] = data
+        self.modified[name] = email.utils.formatdate(1_500_000_000 + self._version, usegmt=True)
+
+    def etag(self, name):
+        return '"' + hashlib.md5(self.files[name]).hexdigest() + '"'
+
+    def count(self, method, name=None):
+        return sum(m == method and (name is None or n == name) for m, n, _ in self.requests)
+
+
+def _handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _empty(self, status, headers=()):
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def _serve(self, body):
+            name = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+            state.requests.append((self.command, name, dict(self.headers)))
+
+            failures = state.fail.get(name)
+            if failures:
+                return self._empty(failures.pop(0))
+            if name not in state.files:
+                return self._empty(404)
+
+            data = state.files[name]
+            etag = state.etag(name)
+            start, status = 0, 200
+
+            ranges, if_range = self.headers.get("Range"), self.headers.get("If-Range")
+            if ranges and if_range in (None, etag, state.modified[name]):
+                start = int(ranges.split("=", 1)[1].split("-", 1)[0])
+                if start >= len(data):
+                    return self._empty(416, [("Content-Range", f"bytes */{len(data)}")])
+                status = 206
+
+            self.send_response(status)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", state.modified[name])
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(data) - start))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            self.end_headers()
+
+            if not body:
+                return
+
+            cut = state.cut.pop(name, None) if self.command == "GET" else None
+            if cut is not None:
+                self.wfile.write(data[start:start + cut])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            self.wfile.write(data[start:])
+
+        def do_GET(self):
+            self._serve(body=True)
+
+        def do_HEAD(self):
+            self._serve(body=False)
+
+    return Handler
+
+
+@pytest.fixture
+def stand_in():
+    state = StandIn()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(state))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    yield state
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,149 @@
+import io
+import os
+import zipfile
+import polars as pl
+import requests
+from data_io.fetch.download import resume_download, sha256_file
+from data_io.fetch.fetch_accident_data import fetch_year
+
+HEADER = (
+    "ULAND;UREGBEZ;UKREIS;UGEMEINDE;UJAHR;UMONAT;USTUNDE;UWOCHENTAG;UKATEGORIE;UTYP1;ULICHTVERH;STRZUSTAND;"
+    "IstRad;IstPKW;IstFuss;IstKrad;IstSonstige;LINREFX;LINREFY;XGCSWGS84;YGCSWGS84"
+)
+
+
+def accident_zip(year, district, rows=50):
+    # one year of the Unfallatlas: semicolon separated, decimal comma, zipped
+    line = f"8;2;{district};1;{year};5;17;3;3;2;0;0;1;0;0;0;0;3476000,5;5475000,25;8,69;49,41"
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr(f"Unfallorte{year}_LinRef.csv", "\n".join([HEADER] + [line] * rows) + "\n")
+    return buffer.getvalue()
+
+
+def zip_name(year):
+    return f"Unfallorte{year}_EPSG25832_CSV.zip"
+
+
+def record(result):
+    # the manifest entry main() stores for a year
+    return {k: result.get(k) for k in ("size", "sha256", "etag", "last_modified", "output")}
+
+
+def folders(tmp_path):
+    raw, out = tmp_path / "raw", tmp_path / "processed"
+    raw.mkdir()
+    out.mkdir()
+    return str(raw), str(out)
+
+
+def districts(folder, year):
+    return pl.read_parquet(os.path.join(folder, f"accidents_{year}.parquet"))["district"].unique().to_list()
+
+
+def test_interrupted_download_is_resumed_with_range(stand_in, tmp_path):
+    data = os.urandom(200_000)
+    stand_in.put("file.zip", data)
+    stand_in.cut["file.zip"] = 50_000
+    path = str(tmp_path / "file.zip")
+
+    result = resume_download(stand_in.url + "file.zip", path, retries=1, backoff=0, chunk_size=1024)
+
+    assert result["error"] is None
+    assert 0 < result["resumed"] <= 50_000
+    assert open(path, "rb").read() == data
+    assert stand_in.requests[-1][2].get("Range") == f"bytes={result['resumed']}-"
+    assert not os.path.exists(path + ".part")
+
+
+def test_changed_etag_restarts_the_download(stand_in, tmp_path):
+    stand_in.put("file.zip", os.urandom(200_000))
+    stand_in.cut["file.zip"] = 50_000
+    path = str(tmp_path / "file.zip")
+
+    first = resume_download(stand_in.url + "file.zip", path, retries=0, chunk_size=1024)
+    assert first["error"] is not None
+    assert os.path.getsize(path + ".part") > 0
+
+    new = os.urandom(150_000)
+    stand_in.put("file.zip", new)
+    result = resume_download(stand_in.url + "file.zip", path, retries=0, chunk_size=1024)
+
+    # the part was offered, the server answered with the whole new file
+    assert stand_in.requests[-1][2].get("If-Range") is not None
+    assert result["error"] is None
+    assert result["resumed"] == 0
+    assert open(path, "rb").read() == new
+
+
+def test_size_or_checksum_mismatch_discards_the_file(stand_in, tmp_path):
+    data = os.urandom(100_000)
+    stand_in.put("file.zip", data)
+    path = str(tmp_path / "file.zip")
+    version = {"etag": stand_in.etag("file.zip"), "last_modified": stand_in.modified["file.zip"]}
+
+    for expected, error in (
+        ({**version, "size": len(data) + 1}, "size mismatch"),
+        ({**version, "size": len(data), "sha256": "0" * 64}, "checksum mismatch"),
+    ):
+        result = resume_download(stand_in.url + "file.zip", path, retries=0, expected=expected)
+
+        assert result["error"].startswith(error)
+        assert not os.path.exists(path)
+        assert not os.path.exists(path + ".part")
+
+
+def test_valid_local_copy_is_not_downloaded(stand_in, tmp_path):
+    raw, out = folders(tmp_path)
+    data = accident_zip(2020, 21)
+    stand_in.put(zip_name(2020), data)
+    with open(os.path.join(raw, zip_name(2020)), "wb") as f:
+        f.write(data)
+
+    entry = {
+        "size": len(data),
+        "sha256": sha256_file(os.path.join(raw, zip_name(2020))),
+        "etag": stand_in.etag(zip_name(2020)),
+        "last_modified": stand_in.modified[zip_name(2020)],
+    }
+    result = fetch_year(requests.Session(), 2020, raw, out, base_url=stand_in.url, retries=0, entry=entry)
+
+    assert result["error"] is None
+    assert stand_in.count("GET") == 0
+    assert districts(out, 2020) == [21]
+
+
+def test_matching_output_skips_the_year(stand_in, tmp_path):
+    raw, out = folders(tmp_path)
+    stand_in.put(zip_name(2020), accident_zip(2020, 21))
+    session = requests.Session()
+
+    first = fetch_year(session, 2020, raw, out, base_url=stand_in.url, retries=0)
+    second = fetch_year(session, 2020, raw, out, base_url=stand_in.url, retries=0, entry=record(first))
+
+    assert first["error"] is None and not first["skipped"]
+    assert second["skipped"]
+    assert second["rows"] == 50
+    assert stand_in.count("GET") == 1
+
+
+def test_new_remote_version_is_downloaded_again(stand_in, tmp_path):
+    raw, out = folders(tmp_path)
+    stand_in.put(zip_name(2020), accident_zip(2020, 21))
+    session = requests.Session()
+
+    # the zip stays in raw (as with --keep-raw)
+    first = fetch_year(session, 2020, raw, out, base_url=stand_in.url, retries=0)
+    assert districts(out, 2020) == [21]
+
+    stand_in.put(zip_name(2020), accident_zip(2020, 99))
+    second = fetch_year(session, 2020, raw, out, base_url=stand_in.url, retries=0, entry=record(first))
+
+    assert second["error"] is None and not second["skipped"]
+    assert districts(out, 2020) == [99]
+    assert second["etag"] == stand_in.etag(zip_name(2020))
+    assert second["last_modified"] == stand_in.modified[zip_name(2020)]
+
+    third = fetch_year(session, 2020, raw, out, base_url=stand_in.url, retries=0, entry=record(second))
+    assert third["skipped"]
+    assert stand_in.count("GET") == 2
@@ -0,0 +1,66 @@
+import polars as pl
+from data_io.formats.formats import BICYCLE_FORMAT
+from data_io.loader.data_loader import DataLoader, BICYCLE_COUNT_COLUMNS
+
+
+def write_station(folder, counts):
+    # one station with small counts (they fit into 8 bit), 15 minute rows
+    rows = []
+    for i, count in enumerate(counts):
+        rows.append({
+            "operator_name": "Stadt Heidelberg",
+            "domain_name": "Stadt Heidelberg",
+            "domain_id": 1,
+            "counter_site": "Teststation",
+            "counter_site_id": 100,
+            "counter_serial": "X1",
+            "longitude": 8.69,
+            "latitude": 49.41,
+            "timezone": "(UTC+01:00) Europe/Berlin",
+            "iso_timestamp": f"2024-01-01T{i // 4:02d}:{15 * (i % 4):02d}:00+0000",
+            "channels_in": count,
+            "channels_out": count,
+            "channels_all": 2 * count,
+            "channels_unknown": 0,
+            "site_temperature": 5.0,
+            "site_rain_accumulation": 0.0,
+            "site_snow_accumulation": 0.0,
+        })
+    folder.mkdir(parents=True)
+    pl.DataFrame(rows, schema=BICYCLE_FORMAT).write_csv(folder / "station_100.csv")
+
+
+def test_counts_do_not_wrap_around(tmp_path, monkeypatch):
+    write_station(tmp_path / "data/processed/cycle_counter/Stadt_Heidelberg", [200, 100, 50, 3])
+    monkeypatch.chdir(tmp_path)
+
+    dl = DataLoader(use_cache=False, workers=1)
+    station = dl.get_bicyle_stations()[0]
+
+    for bd in (dl.get_bicycle(station), dl.get_bicycle(station, sample_rate="1h"), dl.get_bicycle_all()):
+        df = bd.df
+        assert all(df.schema[col] == BICYCLE_FORMAT[col] for col in BICYCLE_COUNT_COLUMNS)
+
+    df = dl.get_bicycle(station).df
+    total = df.select(pl.col("channels_in") + pl.col("channels_out"))["channels_in"]
+    assert total.to_list() == [400, 200, 100, 6]
+    assert (df["channels_all"] * 2).to_list() == [800, 400, 200, 12]
+    assert dl.get_bicycle(station, sample_rate="1h").df["channels_all"].to_list() == [706]
+
+
+def test_memo_and_report_hold_compact_counts(tmp_path, monkeypatch):
+    write_station(tmp_path / "data/processed/cycle_counter/Stadt_Heidelberg", [200, 100, 50, 3] * 24)
+    monkeypatch.chdir(tmp_path)
+
+    dl = DataLoader(use_cache=False, workers=1)
+    station = dl.get_bicyle_stations()[0]
+    report = dl.memory_report().row(0, named=True)
+
+    handed_out = dl.get_bicycle(station)
+    int32_bytes = handed_out.df.estimated_size() + sum(level.estimated_size() for level in handed_out.rollups.values())
+    # the memo and the report count what is held: the compact frame and rollups, not the Int32 copies
+    assert dl.cache_info()["bytes"] == report["bytes_after"] + report["bytes_rollups"] < int32_bytes
+
+    assert dl.get_bicycle(station, lazy=True).df.schema == handed_out.df.schema
+    assert dl.get_bicycle(station).df.equals(handed_out.df)
+    assert dl.cache_info()["hits"] == 2
@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+import polars as pl
+from data_io.fetch import download
+from data_io.fetch.download import fetch_file
+from data_io.fetch.fetch_cycle_data import MANIFEST_NAME, RAW_SCHEMA, changed_months, main, month_file
+
+
+def month_csv_gz(year, month, count=5):
+    # one month of the mobidata export, two stations of one city
+    rows = [
+        ["Stadt", "Heidelberg", 1, f"Zaehler {station}", station, "S1", 8.69, 49.41, "Europe/Berlin",
+         f"{year}-{month:02d}-{day:02d}T{hour:02d}:00:00+0100", count, count, 2 * count, None, None, None, None]
+        for station in (100, 200)
+        for day in (1, 2)
+        for hour in range(24)
+    ]
+    df = pl.DataFrame(rows, schema=RAW_SCHEMA, orient="row")
+    return gzip.compress(df.write_csv().encode())
+
+
+def run(stand_in, folder, *options):
+    main(["--start_year", "2020", "--end_year", "2020", "--folder", str(folder),
+          "--base-url", stand_in.url, "--workers", "2", "--retries", "0", *options])
+
+
+def test_failed_requests_are_retried_with_backoff(stand_in, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(download.time, "sleep", sleeps.append)
+    stand_in.put("file.csv", b"abc")
+    stand_in.fail["file.csv"] = [503, 503]
+
+    result = fetch_file(stand_in.url + "file.csv", lambda r: len(r.content), retries=3, backoff=0.5)
+
+    assert result["error"] is None
+    assert result["attempts"] == 3
+    assert result["bytes"] == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_missing_file_is_not_retried(stand_in, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(download.time, "sleep", sleeps.append)
+
+    result = fetch_file(stand_in.url + "missing.csv", lambda r: 0, retries=3)
+
+    assert result["error"] == "HTTP 404"
+    assert result["attempts"] == 1
+    assert sleeps == []
+
+
+def test_changed_months_skips_missing_months(stand_in):
+    stand_in.put(month_file(2020, 1), month_csv_gz(2020, 1))
+    names = [month_file(2020, 1), month_file(2020, 2)]
+
+    assert changed_months(names, {}, base_url=stand_in.url, retries=0) == [month_file(2020, 1)]
+
+
+def test_incremental_run_only_fetches_changed_months(stand_in, tmp_path):
+    for month in (1, 2):
+        stand_in.put(month_file(2020, month), month_csv_gz(2020, month))
+
+    run(stand_in, tmp_path)
+
+    part_folder = tmp_path / "processed" / "cycle_counter_partitioned"
+    station_file = tmp_path / "processed" / "cycle_counter" / "Heidelberg" / "station_100.csv"
+    manifest = json.loads((part_folder / MANIFEST_NAME).read_text())
+    # the other months are 404 and stay out of the manifest
+    assert sorted(manifest) == [month_file(2020, 1), month_file(2020, 2)]
+    assert pl.read_csv(station_file).height == 2 * 48
+    assert stand_in.count("GET") == 12
+
+    # nothing changed: only HEAD requests
+    run(stand_in, tmp_path, "--incremental")
+    assert stand_in.count("GET") == 12
+    assert stand_in.count("HEAD") == 12
+
+    stand_in.put(month_file(2020, 2), month_csv_gz(2020, 2, count=7))
+    run(stand_in, tmp_path, "--incremental")
+
+    assert stand_in.count("GET") == 13
+    assert stand_in.count("GET", month_file(2020, 2)) == 2
+    df = pl.read_csv(station_file)
+    assert df.height == 2 * 48
+    assert df.filter(pl.col("iso_timestamp").str.starts_with("2020-02"))["channels_all"].unique().to_list() == [14]
+    assert json.loads((part_folder / MANIFEST_NAME).read_text())[month_file(2020, 2)]["etag"] == stand_in.etag(month_file(2020, 2))
+    assert os.path.exists(part_folder / "city=Heidelberg" / "station=200")
@@ -0,0 +1,73 @@
+import gzip
+import io
+import json
+import polars as pl
+import requests
+from data_io.fetch.download import iter_csv_gz
+from data_io.fetch.fetch_weather_data import main
+
+
+def hourly(year, hours=48):
+    # shape of an Open-Meteo archive response
+    time = [f"{year}-01-{1 + h // 24:02d}T{h % 24:02d}:00" for h in range(hours)]
+    values = [float(h % 7) for h in range(hours)]
+    return {
+        "latitude": 49.4,
+        "longitude": 8.7,
+        "hourly": {
+            "time": time,
+            "temperature_2m": values,
+            "relative_humidity_2m": [80] * hours,
+            "precipitation": values,
+            "rain": values,
+            "snowfall": [0.0] * hours,
+            "weather_code": [[0, 3, 61, 4][h % 4] for h in range(hours)],
+            "cloud_cover": [50] * hours,
+            "wind_speed_10m": values,
+            "wind_direction_10m": [270] * hours,
+            "wind_gusts_10m": values,
+        },
+    }
+
+
+def test_streamed_rows_match_the_full_download(stand_in, tmp_path):
+    df = pl.DataFrame({
+        "station": [i % 3 for i in range(500)],
+        "name": [f'site "{i}", north' for i in range(500)],
+        "value": [i * 0.5 for i in range(500)],
+    })
+    data = gzip.compress(df.write_csv().encode())
+    stand_in.put("month.csv.gz", data)
+    url = stand_in.url + "month.csv.gz"
+    raw_path = str(tmp_path / "month.csv.gz")
+
+    with requests.get(url, stream=True) as response:
+        batches = list(iter_csv_gz(response, raw_path=raw_path, batch_size=1024))
+
+    # what the download to disk and read_csv did before
+    full = pl.read_csv(io.BytesIO(gzip.decompress(requests.get(url).content)))
+
+    assert len(batches) > 1
+    assert pl.concat(batches).equals(full)
+    assert full.equals(df)
+    assert open(raw_path, "rb").read() == data
+
+
+def test_second_run_is_answered_from_the_cache(stand_in, tmp_path):
+    stand_in.put("archive", json.dumps(hourly(2020)).encode())
+    argv = ["--start_year", "2020", "--end_year", "2021", "--folder", str(tmp_path), "--workers", "1",
+            "--cache-folder", str(tmp_path / "cache"), "--url", stand_in.url + "archive"]
+    outfile = tmp_path / "processed" / "weather" / "weather_2020.csv"
+
+    main(argv)
+    first = pl.read_csv(outfile)
+    assert stand_in.count("GET") == 1
+    assert first.height == 48
+    assert first["weather_description"].to_list()[:4] == ["Clear sky", "Overcast", "Rain: Slight", "Unknown (4)"]
+
+    main(argv)
+    assert stand_in.count("GET") == 1
+    assert pl.read_csv(outfile).equals(first)
+
+    main(argv + ["--no-cache"])
+    assert stand_in.count("GET") == 2